@@ -10,7 +10,7 @@ import FreeCADGui as Gui
 from freecad.casat import *
 import Part
 from . import nurbs_tools
-from .nurbs_tools import parameterization
+from .nurbs_tools import parameterization_array
 import numpy as np
 vec2 = App.Base.Vector2d
 
@@ -55,19 +55,17 @@ class InterpolationCurve(Curve):
     
     @parameters.setter
     def parameters(self, par):
-        self._params = []
         if isinstance(par,(list,tuple)) and (len(par) == self._num_points):
-            self._params = par
-        elif (par >= 0.) and (par <= 1.):
-            self._params = parameterization(self.get_points(), par)
+            params = np.array(par, dtype=float)
+            self._params = (params / params[-1]).tolist()
         elif par == "Chordlength":
             self.parameters = 1.0
         elif par == "Centripetal":
             self.parameters = 0.5
+        elif isinstance(par,(int,float)) and (par >= 0.) and (par <= 1.):
+            self._params = parameterization_array(self.get_points(), par, normalize=True).tolist()
         else: # default "Uniform"
             self.parameters = 0.0
-        para = [p/self._params[-1] for p in self._params]
-        self._params = para
     
     def get_points(self):
         pts = []
@@ -75,27 +73,36 @@ class InterpolationCurve(Curve):
             pts.append(c[0])
         return pts            
     
-    def compute(self):
-        num_poles = self._num_constraints
-        num_interior_knots = num_poles - self.degree - 1
+    def build_matrix(self):
+        """Compute the knot sequence and returns the collocation matrix
+        of the constraints, and the list of constraint values"""
+        params = list()
+        orders = list()
+        vecs = list()
+        for c,p in zip(self._constraints, self._params):
+            for i,v in enumerate(c):
+                params.append(p)
+                orders.append(i)
+                vecs.append(v)
+        # interior knots are averages of the constraint parameters (Nurbs Book eq. 9.8)
+        # this keeps the collocation matrix banded and non-singular
+        avg = np.convolve(params, np.ones(self.degree) / self.degree, 'valid')
         start = [0.] * (self.degree + 1)
         end = [1.] * (self.degree + 1)
-        mid = [(i+1)/(num_interior_knots+1) for i in range(num_interior_knots)]
+        mid = avg[1:-1].tolist()
         self.flatknots = start + mid + end
         #knots = list(set(self.flatknots))
         bb = nurbs_tools.BsplineBasis()
         bb.knots = self.flatknots
         bb.degree = self.degree
-        matrix  = list()
-        vecs = list()
-        for c,p in zip(self._constraints, self._params):
-            for i,v in enumerate(c):
-                matrix.append(bb.evaluate(p,d=i))
-                vecs.append(v)
-        mat = np.array(matrix)
-        print("Coeff matrix :\n%s\n"%np.array(mat))
-        res = np.linalg.solve(mat,vecs)
-        print("Control points :\n%s\n"%res)
+        mat = nurbs_tools.CollocationMatrix(bb, params, orders)
+        debug("Coeff matrix : {0}x{0}, bandwidth ({1}, {2})".format(mat.size, mat.lower, mat.upper))
+        return mat, vecs
+
+    def compute(self):
+        mat, vecs = self.build_matrix()
+        res = mat.solve(np.array(vecs))
+        debug("Control points :\n{}".format(res))
         self.poles = [App.Vector(s) for s in res]
 
     def get_curve(self):
@@ -114,3 +121,39 @@ class InterpolationCurve(Curve):
 
     def show(self):
         Part.show(self.get_edge())
+
+def interpolate_many(point_sets, parameters=1.0, degree=3):
+    """Interpolate several sets of points that share the same parameters.
+    list_of_curves = interpolate_many(point_sets, parameters=1.0, degree=3)
+    point_sets : list of lists of points, all with the same number of points
+    parameters : list of parameters, or parameterization factor (see InterpolationCurve.parameters)
+                 With a factor, the parameters are averaged over all the point sets.
+    The collocation matrix is factorized once and solved for all the point sets together.
+    Output : list of BSplineCurves"""
+    if len(point_sets) == 0:
+        return []
+    num = len(point_sets[0])
+    if not all(len(pts) == num for pts in point_sets):
+        error("interpolate_many : point sets have different sizes")
+        return []
+    ic = InterpolationCurve(point_sets[0])
+    ic.degree = degree
+    if isinstance(parameters,(list,tuple)):
+        ic.parameters = parameters
+    else:
+        params = np.zeros(num)
+        for pts in point_sets:
+            ic.constraints = pts
+            ic.parameters = parameters
+            params += ic.parameters
+        ic.parameters = (params / len(point_sets)).tolist()
+    mat, vecs = ic.build_matrix()
+    mat.factorize()
+    # stack the point sets as the columns of a single right-hand side
+    rhs = np.concatenate([np.array(pts, dtype=float) for pts in point_sets], axis=1)
+    res = mat.solve(rhs)
+    curves = []
+    for i in range(len(point_sets)):
+        ic.poles = [App.Vector(p) for p in res[:,3*i:3*i+3]]
+        curves.append(ic.get_curve())
+    return curves
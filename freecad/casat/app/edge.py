@@ -1,4 +1,8 @@
+import FreeCAD
+import Part
+import numpy as np
 from freecad.casat import *
+from . import nurbs_tools
 debug("edge python module")
 
 class Edge(object):
@@ -11,26 +15,62 @@ def scale_edge(edge, factor=1.0):
     new_range = (lp - fp) * factor
     return edge.Curve.toShape(fp, fp + new_range)
 
+def deviation(edge1, edge2, nb_samples=100):
+    """Projects nb_samples points of edge1 on edge2, in one vectorized pass.
+    pts, params, foot, dist = deviation(edge1, edge2, nb_samples=100)
+    Returns arrays of the sample points, and of their projection parameters, foot points and distances on edge2"""
+    pts = np.array(edge1.discretize(nb_samples), dtype=float)
+    proj = nurbs_tools.CurveProjector(edge2)
+    params, foot, dist = proj.project(pts)
+    return pts, params, foot, dist
+
 def get_diff(edge1, edge2, nb_samples=100, factor=1.0):
     tol = 1e-7
     edges = []
-    for p in edge1.discretize(nb_samples):
-        d, pts, info = Part.Vertex(p).distToShape(edge2)
-        if d > tol:
-            e = Part.makeLine(*pts[0])
-            edges.append(scale_edge(e, factor * edge1.Length))
+    pts, params, foot, dist = deviation(edge1, edge2, nb_samples)
+    for p1, p2 in zip(pts[dist > tol], foot[dist > tol]):
+        e = Part.makeLine(FreeCAD.Vector(*p1), FreeCAD.Vector(*p2))
+        edges.append(scale_edge(e, factor * edge1.Length))
     return Part.Compound(edges)
 
-def max_diff(edge1, edge2, nb_samples=100, factor=0.5):
-    max_dist = 0.0
-    max_pts = None
-    for p in edge1.discretize(nb_samples):
-        d, pts, info = Part.Vertex(p).distToShape(edge2)
-        if max_dist < d:
-            max_dist = d
-            max_pts = pts[0]
-    print("Maximum distance : {} at {}".format(max_dist, max_pts[0]))
+def max_diff(edge1, edge2, nb_samples=100, factor=0.5, tol=1e-6):
+    """Hausdorff distance between edge1 and edge2, with an adaptive search.
+    nb_samples is the size of the initial bracket of each edge.
+    Returns the line between the farthest point and its projection, scaled by factor * edge1.Length"""
+    max_dist, max_pts, bound = nurbs_tools.hausdorff_distance(edge1, edge2, tol, samples=nb_samples)
+    max_pts = [FreeCAD.Vector(*p) for p in max_pts]
+    print("Maximum distance : {} (+{}) at {}".format(max_dist, bound - max_dist, max_pts[0]))
     e = Part.makeLine(*max_pts)
     return scale_edge(e, factor * edge1.Length)
 
-def approximate(edge, nb_samples=20, tol=1e-3)
+def approximate(edge, nb_samples=20, tol=1e-3, degree=3, max_samples=5000, max_evals=None):
+    """Least-squares BSpline approximation of an edge.
+    bs = approximate(edge, nb_samples=20, tol=1e-3, degree=3, max_samples=5000, max_evals=None)
+    The curve is fitted on nb_samples points of the edge, at their parameters on the edge,
+    with knots added until they are all within tol / 2,
+    and at most one pole for two points, so that the curve doesn't swing between the points.
+    Its deviation from the whole edge is then bounded with nurbs_tools.hausdorff_distance,
+    with max_evals distances per direction (default : 100 per pole of the curve and sample of the edge).
+    If the bound is not conclusive, the search budget is raised.
+    If the deviation is above tol, the number of samples is doubled, until max_samples is reached.
+    Returns a BSplineCurve with the parameter range of the edge."""
+    proj = nurbs_tools.CurveProjector(edge)
+    nb = nb_samples
+    while True:
+        pts = np.array(edge.discretize(nb), dtype=float)
+        bs, dist = nurbs_tools.approximate_points(pts, proj.project(pts)[0], degree, 0.5 * tol, max(degree + 1, nb // 2))
+        evals = max_evals or 100 * (bs.NbPoles + nb)
+        while True:
+            dist, max_pts, bound = nurbs_tools.hausdorff_distance(bs, edge, 0.1 * tol, samples=max(50, nb), max_evals=evals)
+            # raise the budget only if the search stopped on it, below tol
+            converged = bound - dist <= 0.1 * tol + 1e-3 * dist
+            if bound <= tol or dist > tol or converged or max_evals:
+                break
+            evals *= 4
+        if bound <= tol or nb >= max_samples:
+            break
+        nb = min(2 * nb, max_samples)
+    if bound > tol:
+        error("approximate : tolerance not reached ({} > {})".format(bound, tol))
+    bs.scaleKnotsToBounds(*edge.ParameterRange)
+    return bs
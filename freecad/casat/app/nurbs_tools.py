@@ -5,9 +5,24 @@ __author__ = "Christophe Grellier (Chris_G)"
 __license__ = "LGPL 2.1"
 __doc__ = "Collection of tools for Nurbs."
 
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import heapq
+from math import comb
 import FreeCAD
 import Part
+import numpy as np
 from freecad.casat import *
+try:
+    from scipy.linalg import solve_banded, solveh_banded
+    from scipy.linalg.lapack import dgbtrf, dgbtrs
+except ImportError:
+    solve_banded = solveh_banded = None
+    dgbtrf = dgbtrs = None
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
 #import _utils
 #debug = _utils.debug
 #debug = _utils.doNothing
@@ -32,78 +47,173 @@ def get_bspline_data(curve): # returns a dictionary of the BSpline data
 
 def is_same(c1, c2, tol=1e-7, full=False): # Check if BSpline curves c1 and c2 are equal
     """Check if BSpline curves c1 and c2 are equal
+    If full is True, the mismatches are printed in the console.
     return a bool
     """
-    valid = True
-    if full:
-        message("\nCurves comparison\n")
-    dat1 = get_bspline_data(c1)
-    dat2 = get_bspline_data(c2)
+    dat1 = get_bspline_arrays(c1)
+    dat2 = get_bspline_arrays(c2)
+    if not full:
+        return _same_arrays(dat1, dat2, tol)
+    message("\nCurves comparison\n")
+    report = compare_report(dat1, dat2, tol)
+    for line in report:
+        message(line + "\n")
+    if report:
+        return False
+    message("Curves are matching.")
+    return True
+
+def compare_report(dat1, dat2, tol=1e-7):
+    """Returns the list of the mismatches between BSpline arrays dat1 and dat2 (see get_bspline_arrays)
+    The list is empty if the curves are equal"""
+    report = []
     for key in ['Type', 'Continuity', 'Degree', 'isClosed', 'isPeriodic', 'isRational']:
         if not dat1[key] == dat2[key]:
-            if full:
-                message("{} mismatch : {} != {}\n".format(key, str(dat1[key]), str(dat2[key])))
-                valid = False
-            else:
-                return False
+            report.append("{} mismatch : {} != {}".format(key, str(dat1[key]), str(dat2[key])))
+    same_length = True
     for key in ["KnotSequence", "Poles", "Weights"]:
         if not len(dat1[key]) == len(dat2[key]):
-            if full:
-                message("{} list length mismatch : {} != {}\n".format(key, str(len(dat1[key])), str(len(dat2[key]))))
-                valid = False
-            else:
-                return False
-    i = 0
-    for k1, k2 in zip(dat1["KnotSequence"], dat2["KnotSequence"]):
-        if abs(k1-k2) > tol:
-            if full:
-                message("Knot #{} mismatch : {} != {}\n".format(i, k1, k2))
-                valid = False
-            else:
-                return False
-        i += 1
-    i = 0
-    for p1, p2 in zip(dat1["Poles"], dat2["Poles"]):
-        if p1.distanceToPoint(p2) > tol:
-            if full:
-                message("Pole #{} mismatch : {} != {}\n".format(i, p1, p2))
-                valid = False
-            else:
-                return False
-        i += 1
-    i = 0
-    for w1, w2 in zip(dat1["Weights"], dat2["Weights"]):
-        if abs(w1-w2) > tol:
-            if full:
-                message("Weight #{} mismatch : {} != {}\n".format(i, w1, w2))
-                valid = False
-            else:
-                return False
-        i += 1
-    if full:
-        if valid:
-            message("Curves are matching.")
+            report.append("{} list length mismatch : {} != {}".format(key, str(len(dat1[key])), str(len(dat2[key]))))
+            same_length = False
+    if not same_length:
+        return report
+    k1, k2 = dat1["KnotSequence"], dat2["KnotSequence"]
+    for i in np.nonzero(np.abs(k1 - k2) > tol)[0]:
+        report.append("Knot #{} mismatch : {} != {}".format(i, k1[i], k2[i]))
+    p1, p2 = dat1["Poles"], dat2["Poles"]
+    for i in np.nonzero(np.linalg.norm(p1 - p2, axis=1) > tol)[0]:
+        report.append("Pole #{} mismatch : {} != {}".format(i, FreeCAD.Vector(*p1[i]), FreeCAD.Vector(*p2[i])))
+    w1, w2 = dat1["Weights"], dat2["Weights"]
+    for i in np.nonzero(np.abs(w1 - w2) > tol)[0]:
+        report.append("Weight #{} mismatch : {} != {}".format(i, w1[i], w2[i]))
+    return report
+
+def is_same_many(curves_a, curves_b, tol=1e-7, report=False):
+    """Check if the BSpline curves of curves_a and curves_b are pairwise equal
+    result = is_same_many(curves_a, curves_b, tol=1e-7)
+    result, reports = is_same_many(curves_a, curves_b, tol=1e-7, report=True)
+    result is a boolean array.
+    reports is a list of the mismatch reports (see compare_report), only built if report is True.
+    Pairs with the same structure are compared together, as stacked arrays."""
+    if not len(curves_a) == len(curves_b):
+        error("is_same_many : lists have different lengths")
+        raise ValueError
+    data = dict()
+    def get_data(c):
+        if id(c) not in data:
+            data[id(c)] = get_bspline_arrays(c)
+        return data[id(c)]
+    dat_a = [get_data(c) for c in curves_a]
+    dat_b = [get_data(c) for c in curves_b]
+    result = np.zeros(len(dat_a), dtype=bool)
+    groups = dict()
+    for i, (d1, d2) in enumerate(zip(dat_a, dat_b)):
+        struct = []
+        for key in ['Type', 'Continuity', 'Degree', 'isClosed', 'isPeriodic', 'isRational']:
+            if not d1[key] == d2[key]:
+                break
         else:
+            for key in ["KnotSequence", "Poles", "Weights"]:
+                if not len(d1[key]) == len(d2[key]):
+                    break
+                struct.append(len(d1[key]))
+            else:
+                groups.setdefault(tuple(struct), []).append(i)
+    for idx in groups.values():
+        ok = np.ones(len(idx), dtype=bool)
+        for key in ["KnotSequence", "Weights"]:
+            a1 = np.array([dat_a[i][key] for i in idx])
+            a2 = np.array([dat_b[i][key] for i in idx])
+            ok &= np.all(np.abs(a1 - a2) <= tol, axis=1)
+        p1 = np.array([dat_a[i]["Poles"] for i in idx])
+        p2 = np.array([dat_b[i]["Poles"] for i in idx])
+        ok &= np.all(np.linalg.norm(p1 - p2, axis=2) <= tol, axis=1)
+        result[idx] = ok
+    if not report:
+        return result
+    reports = [[] if r else compare_report(d1, d2, tol) for r, d1, d2 in zip(result, dat_a, dat_b)]
+    return result, reports
+
+def get_bspline_arrays(curve): # returns a dictionary of the BSpline data, with numpy arrays
+    """returns a dictionary of the BSpline data
+    Same as get_bspline_data, but KnotSequence, Poles and Weights are numpy arrays
+    """
+    dic = get_bspline_data(curve)
+    dic["KnotSequence"] = np.array(dic["KnotSequence"], dtype=float)
+    dic["Poles"] = np.array(dic["Poles"], dtype=float).reshape(-1, 3)
+    dic["Weights"] = np.array(dic["Weights"], dtype=float)
+    return dic
+
+def _same_arrays(dat1, dat2, tol=1e-7):
+    """Check if the BSpline arrays dat1 and dat2 (see get_bspline_arrays) are equal"""
+    for key in ['Type', 'Continuity', 'Degree', 'isClosed', 'isPeriodic', 'isRational']:
+        if not dat1[key] == dat2[key]:
+            return False
+    for key in ["KnotSequence", "Poles", "Weights"]:
+        if not len(dat1[key]) == len(dat2[key]):
             return False
+    if np.any(np.abs(dat1["KnotSequence"] - dat2["KnotSequence"]) > tol):
+        return False
+    if np.any(np.linalg.norm(dat1["Poles"] - dat2["Poles"], axis=1) > tol):
+        return False
+    if np.any(np.abs(dat1["Weights"] - dat2["Weights"]) > tol):
+        return False
     return True
-    
+
 def remove_duplicates(curves, tol=1e-7): # remove duplicate curves from a list
-    "remove duplicate curves from a list"
+    """remove duplicate curves from a list
+    The curve data is extracted once per curve, and the curves are sorted in
+    hash buckets, keyed by their structure and the centroid of their poles quantized at tol.
+    When all the poles of two curves are within tol, so are their centroids,
+    so only the curves of the same bucket, or of the neighbour buckets, are compared.
+    Unlike the first pole, the centroid separates the curves that share a start vertex."""
     ret = []
     dups = 0
-    for i, c1 in enumerate(curves):
+    cell = 2.0 * max(tol, 1e-12)
+    offsets = [(i, j, k) for i in (-1,0,1) for j in (-1,0,1) for k in (-1,0,1)]
+    buckets = dict()
+    for c1 in curves:
+        dat1 = get_bspline_arrays(c1)
+        struct = (dat1['Type'], dat1['Continuity'], dat1['Degree'], dat1['isClosed'], dat1['isPeriodic'], dat1['isRational'],
+                  len(dat1["KnotSequence"]), len(dat1["Poles"]))
+        cx, cy, cz = [int(v) for v in np.floor(dat1["Poles"].mean(axis=0) / cell)]
         found = False
-        for j, c2 in enumerate(ret):
-            #print("checking curves #{} and #{}".format(i,j+i+1))
-            if is_same(c1, c2, tol):
-                found = True
-                dups += 1
+        for i, j, k in offsets:
+            for dat2 in buckets.get(struct + (cx+i, cy+j, cz+k), []):
+                if _same_arrays(dat1, dat2, tol):
+                    found = True
+                    break
+            if found:
                 break
-        if not found:
+        if found:
+            dups += 1
+        else:
+            buckets.setdefault(struct + (cx, cy, cz), []).append(dat1)
             ret.append(c1)
     message("Removed {} duplicate curves\n".format(dups))
     return ret
 
+def _edge_shape(edge):
+    """Returns edge, or the edge of a curve"""
+    try:
+        return edge.toShape()
+    except AttributeError:
+        return edge
+
+def _sample_order(num):
+    """Order of the 'num' samples of is_subsegment : ends and middle first,
+    since they are the most likely to fail"""
+    first = [0, num-1, num//2]
+    return first + [i for i in range(num) if i not in first]
+
+def _is_subsegment(pts, projector, tol):
+    """check if the points pts (array of shape (n,3)) are closer than tol to the curve of projector.
+    The first 3 points are checked first, and the check stops there if one of them fails."""
+    for chunk in (pts[:3], pts[3:]):
+        if len(chunk) and np.any(projector.distances(chunk) > tol):
+            return False
+    return True
+
 def is_subsegment(edge_1, edge_2, num=20, tol=1e-7): # check if edge_1 is a trim of edge_2.
     """check if edge_1 is a trim of edge_2.
     Usage :
@@ -111,51 +221,223 @@ def is_subsegment(edge_1, edge_2, num=20, tol=1e-7): # check if edge_1 is a trim
     'num' points are sampled on edge_1
     return False if a point is farther than tol.
     """
-    try:
-        e1 = edge_1.toShape()
-        e2 = edge_2.toShape()
-    except AttributeError:
-        e1 = edge_1
-        e2 = edge_2
-    dist = 0
-    for p in e1.discretize(num):
-        d, pts, info = Part.Vertex(p).distToShape(e2)
-        if d > tol:
-            return False
-    return True
+    e1 = _edge_shape(edge_1)
+    e2 = _edge_shape(edge_2)
+    pts = np.array(e1.discretize(num), dtype=float)[_sample_order(num)]
+    return _is_subsegment(pts, CurveProjector(e2), tol)
+
+def _overlapping_boxes(boxes):
+    """Sweep and prune of axis aligned bounding boxes.
+    boxes is an array of shape (n,6) : xmin, ymin, zmin, xmax, ymax, zmax
+    Returns the list of the sets of box indices that overlap each box."""
+    n = len(boxes)
+    order = np.argsort(boxes[:,0], kind='stable')
+    sb = boxes[order]
+    # boxes of the sorted list that start before the end of each box
+    ends = np.searchsorted(sb[:,0], sb[:,3], side='right')
+    overlaps = [set() for i in range(n)]
+    for a in range(n):
+        cand = np.arange(a+1, ends[a])
+        ok = np.all((sb[cand,1:3] <= sb[a,4:6]) & (sb[cand,4:6] >= sb[a,1:3]), axis=1)
+        for b in order[cand[ok]]:
+            overlaps[order[a]].add(b)
+            overlaps[b].add(order[a])
+    return overlaps
 
 def remove_subsegments(edges, num=20, tol=1e-7): # remove subsegment edges from a list
-    "remove subsegment edges from a list"
+    """remove subsegment edges from a list
+    Only the edges with overlapping bounding boxes are compared.
+    Each edge is sampled once, and the samples are projected on the other curves with numpy."""
     ret = []
+    kept = []
     dups = 0
+    shapes = [_edge_shape(e) for e in edges]
+    boxes = np.array([[bb.XMin, bb.YMin, bb.ZMin, bb.XMax, bb.YMax, bb.ZMax] for bb in [sh.BoundBox for sh in shapes]], dtype=float)
+    boxes[:,:3] -= tol
+    boxes[:,3:] += tol
+    overlaps = _overlapping_boxes(boxes)
+    order = _sample_order(num)
+    samples = dict()
+    projectors = dict()
+    def is_sub(i, j):
+        if i not in samples:
+            samples[i] = np.array(shapes[i].discretize(num), dtype=float)[order]
+        if j not in projectors:
+            projectors[j] = CurveProjector(shapes[j])
+        return _is_subsegment(samples[i], projectors[j], tol)
     for i, e1 in enumerate(edges):
         found = False
-        for j, e2 in enumerate(edges):
-            if not i == j:
-                if is_subsegment(e1, e2, num, tol):
-                    if is_subsegment(e2, e1, num, tol): # e1 == e2
-                        for k, e3 in enumerate(ret):
-                            if is_subsegment(e1, e3, num, tol):
-                                found = True
-                                dups += 1
-                                break
-                    else:
-                        found = True
-                        dups += 1
-                        break
+        for j in sorted(overlaps[i]):
+            if is_sub(i, j):
+                if is_sub(j, i): # e1 == e2
+                    for k in kept:
+                        if (k in overlaps[i]) and is_sub(i, k):
+                            found = True
+                            break
+                else:
+                    found = True
+            if found:
+                dups += 1
+                break
         if not found:
             ret.append(e1)
+            kept.append(i)
     message("Removed {} subsegment edges\n".format(dups))
     return ret
 
 def error(s):
     FreeCAD.Console.PrintError(s)
 
+class SpanIndex(object):
+    """Knot span lookup table of a knot sequence.
+    si = SpanIndex(knots, degree)
+    Parameters below the first knot, or above the last one,
+    are attached to the first, or last, non-empty span.
+    Repeated knots are attached to the span that starts at their last occurrence."""
+    def __init__(self, knots, degree):
+        self.knots = np.asarray(knots, dtype=float)
+        self.degree = degree
+        self._list = self.knots.tolist()
+        n = len(self._list) - degree - 1
+        # first and last non-empty spans of the valid range [degree, n-1]
+        self.first = degree
+        while (self.first < n-1) and (self._list[self.first] == self._list[self.first+1]):
+            self.first += 1
+        self.last = n-1
+        while (self.last > degree) and (self._list[self.last] == self._list[self.last+1]):
+            self.last -= 1
+        self._hint = self.first
+
+    def find_array(self, u):
+        """ Determine the knot span indices of an array of parameters.
+        - input: parameters u (array of floats)
+        - output: the knot span indices (array of ints)
+        """
+        spans = np.searchsorted(self.knots, u, side='right') - 1
+        return np.clip(spans, self.first, self.last)
+
+    def find(self, u):
+        """ Determine the knot span index of a parameter.
+        - input: parameter u (float)
+        - output: the knot span index (int)
+        The span found by the previous call is tested first,
+        so sorted parameter sweeps seldom need a search.
+        """
+        knots = self._list
+        h = self._hint
+        if knots[h] <= u < knots[h+1]:
+            return h
+        if (h < self.last) and (knots[h+1] <= u < knots[h+2]):
+            self._hint = h+1
+            return h+1
+        if u < knots[self.first+1]:
+            span = self.first
+        elif u >= knots[self.last]:
+            span = self.last
+        else:
+            span = bisect_right(knots, u, self.first, self.last+1) - 1
+        self._hint = span
+        return span
+
+class BasisCache(object):
+    """Least recently used cache of basis function tables.
+    cache = BasisCache(maxsize=128, maxbytes=64*2**20)
+    Tables are keyed by (knot sequence, degree, parameters, derivative order).
+    The least recently used tables are evicted as soon as the cache holds
+    more than maxsize tables, or more than maxbytes bytes.
+    Cached tables are read-only arrays."""
+    def __init__(self, maxsize=128, maxbytes=64*2**20):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._tables = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __repr__(self):
+        return "BasisCache(tables={}, bytes={}, hits={}, misses={})".format(len(self), self.nbytes, self.hits, self.misses)
+
+    def get(self, basis, u, d=0):
+        """Returns the result of basis.evaluate_array(u, d), from the cache if possible"""
+        u = np.atleast_1d(np.asarray(u, dtype=float))
+        key = (basis.span_index.knots.tobytes(), basis.degree, u.tobytes(), d)
+        if key in self._tables:
+            self.hits += 1
+            self._tables.move_to_end(key)
+            return self._tables[key]
+        self.misses += 1
+        spans = basis.find_spans(u)
+        ders = basis.ders_basis_funs_array(spans, u, d)
+        spans.setflags(write=False)
+        ders.setflags(write=False)
+        self._tables[key] = (spans, ders)
+        self.nbytes += self._size(key)
+        self.evict()
+        return spans, ders
+
+    def _size(self, key):
+        spans, ders = self._tables[key]
+        return len(key[0]) + len(key[2]) + spans.nbytes + ders.nbytes
+
+    def evict(self):
+        """Remove the least recently used tables until the cache fits in maxsize and maxbytes"""
+        while self._tables and ((len(self._tables) > self.maxsize) or (self.nbytes > self.maxbytes)):
+            key = next(iter(self._tables))
+            self.nbytes -= self._size(key)
+            del self._tables[key]
+
+    def clear(self):
+        """Remove all the tables, and reset the counters"""
+        self._tables.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """Returns a dictionary of the cache statistics"""
+        return dict(tables=len(self), bytes=self.nbytes, hits=self.hits, misses=self.misses,
+                    maxsize=self.maxsize, maxbytes=self.maxbytes)
+
+# default cache, shared by curvematch
+basis_cache = BasisCache()
+
 class BsplineBasis(object):
-    """Computes basis functions of a bspline curve, and its derivatives"""
-    def __init__(self):
+    """Computes basis functions of a bspline curve, and its derivatives
+    bb = BsplineBasis(cache=None)
+    If a BasisCache is given, the basis tables are looked up in it."""
+    def __init__(self, cache=None):
+        self._span_index = None
         self.knots = [0.0, 0.0, 1.0, 1.0]
         self.degree = 1
+        self.cache = cache
+
+    @property
+    def knots(self):
+        return self._knots
+
+    @knots.setter
+    def knots(self, k):
+        self._knots = k
+        self._span_index = None
+
+    @property
+    def degree(self):
+        return self._degree
+
+    @degree.setter
+    def degree(self, d):
+        self._degree = d
+        self._span_index = None
+
+    @property
+    def span_index(self):
+        """The span lookup table of the knot sequence"""
+        if self._span_index is None:
+            self._span_index = SpanIndex(self._knots, self._degree)
+        return self._span_index
 
     def find_span(self,u):
         """ Determine the knot span index.
@@ -163,19 +445,7 @@ class BsplineBasis(object):
         - output: the knot span index (int)
         Nurbs Book Algo A2.1 p.68
         """
-        n = len(self.knots)-self.degree-1
-        if u == self.knots[n+1]:
-            return n-1
-        low = self.degree
-        high = n+1
-        mid = int((low+high)/2)
-        while (u < self.knots[mid] or u >= self.knots[mid+1]):
-            if (u < self.knots[mid]):
-                high = mid
-            else:
-                low = mid
-            mid = int((low+high)/2)
-        return mid
+        return self.span_index.find(u)
 
     def basis_funs(self, i, u):
         """ Compute the nonvanishing basis functions.
@@ -267,40 +537,616 @@ class BsplineBasis(object):
         """
         n = len(self.knots)-self.degree-1
         f = [0.0 for x in range(n)]
-        span = self.find_span(u)
-        ders = self.ders_basis_funs(span, u, d)
+        if self.cache is not None:
+            spans, ders = self.cache.get(self, u, d)
+            span = spans[0]
+            ders = ders[0]
+        else:
+            span = self.find_span(u)
+            ders = self.ders_basis_funs(span, u, d)
         for i,val in enumerate(ders[d]):
-            f[span-self.degree+i] = val
+            f[span-self.degree+i] = float(val)
         return f
 
+    def find_spans(self, u):
+        """ Determine the knot span indices of an array of parameters.
+        - input: parameters u (array of floats)
+        - output: the knot span indices (array of ints)
+        """
+        return self.span_index.find_array(u)
+
+    def ders_basis_funs_array(self, spans, u, n):
+        """ Compute nonzero basis functions and their derivatives for an array of parameters.
+        Same algorithm as ders_basis_funs, vectorized over the parameters.
+        - input: span indices (array of ints), parameters u (array of floats), number of derivatives n (int)
+        - output: basis functions and derivatives ders (array of floats, shape (len(u), n+1, degree+1))
+        Nurbs Book Algo A2.3 p.72
+        """
+        p = self.degree
+        knots = self.span_index.knots
+        u = np.asarray(u, dtype=float)
+        m = len(u)
+        ders = np.zeros((m, n+1, p+1))
+        ndu = np.ones((m, p+1, p+1))
+        left = np.zeros((m, p+1))
+        right = np.zeros((m, p+1))
+        for j in range(1, p+1):
+            left[:,j] = u - knots[spans+1-j]
+            right[:,j] = knots[spans+j] - u
+            saved = np.zeros(m)
+            for r in range(j):
+                ndu[:,j,r] = right[:,r+1] + left[:,j-r]
+                temp = ndu[:,r,j-1] / ndu[:,j,r]
+                ndu[:,r,j] = saved + right[:,r+1] * temp
+                saved = left[:,j-r] * temp
+            ndu[:,j,j] = saved
+        ders[:,0,:] = ndu[:,:,p]
+        # derivatives of order higher than the degree are null
+        nd = min(n, p)
+        for r in range(0, p+1):
+            s1 = 0
+            s2 = 1
+            a = np.zeros((m, 2, p+1))
+            a[:,0,0] = 1.0
+            for k in range(1, nd+1):
+                d = np.zeros(m)
+                rk = r-k
+                pk = p-k
+                if r >= k:
+                    a[:,s2,0] = a[:,s1,0] / ndu[:,pk+1,rk]
+                    d = a[:,s2,0] * ndu[:,rk,pk]
+                if rk >= -1:
+                    j1 = 1
+                else:
+                    j1 = -rk
+                if (r-1) <= pk:
+                    j2 = k-1
+                else:
+                    j2 = p-r
+                for j in range(j1, j2+1):
+                    a[:,s2,j] = (a[:,s1,j]-a[:,s1,j-1]) / ndu[:,pk+1,rk+j]
+                    d += a[:,s2,j] * ndu[:,rk+j,pk]
+                if r <= pk:
+                    a[:,s2,k] = -a[:,s1,k-1] / ndu[:,pk+1,r]
+                    d += a[:,s2,k] * ndu[:,r,pk]
+                ders[:,k,r] = d
+                s1, s2 = s2, s1
+        r = p
+        for k in range(1, nd+1):
+            ders[:,k,:] *= r
+            r *= (p-k)
+        return ders
+
+    def evaluate_array(self, u, d=0):
+        """ Compute the nonzero basis functions, and their derivatives up to d,
+        for an array of parameters.
+        - input: parameters u (array of floats), derivative d (int)
+        - output: span indices (array of ints, shape (len(u),)),
+                  derivatives 0 to d of the nonzero basis functions (array of floats, shape (len(u), d+1, degree+1))
+        The basis function ders[i,k,j] is attached to the pole of index spans[i]-degree+j
+        """
+        if self.cache is not None:
+            return self.cache.get(self, u, d)
+        u = np.atleast_1d(np.asarray(u, dtype=float))
+        spans = self.find_spans(u)
+        ders = self.ders_basis_funs_array(spans, u, d)
+        return spans, ders
+
+class CollocationMatrix(object):
+    """Banded collocation matrix of a BSpline basis.
+    Each row holds a derivative of the basis functions at a parameter.
+    cm = CollocationMatrix(basis, params, orders)
+    - basis : BsplineBasis
+    - params : parameter of each row (list of floats)
+    - orders : derivative order of each row (list of ints)
+    Only the nonzero band of the matrix is stored."""
+    def __init__(self, basis, params, orders):
+        params = np.asarray(params, dtype=float)
+        orders = np.asarray(orders, dtype=int)
+        self.degree = basis.degree
+        self.size = len(basis.knots) - basis.degree - 1
+        if not len(params) == self.size:
+            error("CollocationMatrix : {} rows for {} poles".format(len(params), self.size))
+            raise ValueError
+        spans, ders = basis.evaluate_array(params, int(orders.max()))
+        self.first_cols = spans - self.degree
+        self.values = ders[np.arange(len(params)), orders]
+        self.update()
+
+    def update(self):
+        """Compute the bandwidth and the band storage of the matrix,
+        after first_cols, values or size have been modified.
+        The factorization is discarded."""
+        rows = np.arange(self.size)
+        self.lower = max(0, int(np.max(rows - self.first_cols)))
+        self.upper = max(0, int(np.max(self.first_cols + self.degree - rows)))
+        self.band = self._band_storage(self.upper)
+        self._lu = None
+
+    def _band_storage(self, top):
+        """Returns the matrix in LAPACK band storage, with 'top' rows above the diagonal"""
+        band = np.zeros((top + self.lower + 1, self.size))
+        rows = np.arange(self.size)[:,None]
+        cols = self.first_cols[:,None] + np.arange(self.degree+1)[None,:]
+        mask = (cols >= 0) & (cols < self.size)
+        band[(top + rows - cols)[mask], cols[mask]] = self.values[mask]
+        return band
+
+    def to_dense(self):
+        """Returns the full matrix (2D array)"""
+        mat = np.zeros((self.size, self.size))
+        rows = np.arange(self.size)[:,None]
+        cols = self.first_cols[:,None] + np.arange(self.degree+1)[None,:]
+        mask = (cols >= 0) & (cols < self.size)
+        mat[np.broadcast_to(rows, cols.shape)[mask], cols[mask]] = self.values[mask]
+        return mat
+
+    def factorize(self):
+        """Compute the banded LU factorization of the matrix.
+        The factorization is reused by all the following calls to solve().
+        Without scipy, this does nothing, and solve() stays a dense solver."""
+        if dgbtrf is None:
+            return
+        lu, piv, info = dgbtrf(self._band_storage(self.lower + self.upper), self.lower, self.upper)
+        if info > 0:
+            raise np.linalg.LinAlgError("singular matrix")
+        self._lu = (lu, piv)
+
+    def solve(self, rhs):
+        """Solve the linear system for the right-hand side rhs (array of shape (size,) or (size, k))
+        Uses a banded solver if scipy is available, a dense one otherwise."""
+        rhs = np.asarray(rhs, dtype=float)
+        if solve_banded is None:
+            return np.linalg.solve(self.to_dense(), rhs)
+        if self._lu is None:
+            return solve_banded((self.lower, self.upper), self.band, rhs)
+        lu, piv = self._lu
+        b = rhs.reshape(self.size, -1)
+        x, info = dgbtrs(lu, self.lower, self.upper, b, piv)
+        return x.reshape(rhs.shape)
+
+class BsplineCurveEvaluator(object):
+    """Evaluates a BSpline curve, and its derivatives, on arrays of parameters.
+    ev = BsplineCurveEvaluator(data)
+    data is the dictionary returned by get_bspline_data(curve), or the BSpline curve itself.
+    Rational and periodic curves are supported."""
+    def __init__(self, data):
+        if not isinstance(data, dict):
+            data = get_bspline_data(data)
+        self.basis = BsplineBasis()
+        self.basis.knots = list(data["KnotSequence"])
+        self.basis.degree = data["Degree"]
+        self.degree = data["Degree"]
+        self.rational = data["isRational"]
+        poles = np.array(data["Poles"], dtype=float)
+        weights = np.array(data["Weights"], dtype=float)
+        nb_poles = len(self.basis.knots) - self.degree - 1
+        if nb_poles > len(poles): # periodic curve : wrap the poles
+            idx = np.arange(nb_poles) % len(poles)
+            poles = poles[idx]
+            weights = weights[idx]
+        # homogeneous poles
+        self.cpw = np.hstack([poles * weights[:,None], weights[:,None]])
+        self.first_parameter = self.basis.knots[self.degree]
+        self.last_parameter = self.basis.knots[nb_poles]
+
+    def derivatives(self, u, d=0):
+        """Compute the points and derivatives of the curve.
+        - input: parameters u (array of floats), derivative d (int)
+        - output: derivatives 0 to d of the curve (array of floats, shape (d+1, len(u), 3))
+        Nurbs Book Algo A3.2 p.93 and A4.2 p.127"""
+        spans, ders = self.basis.evaluate_array(u, d)
+        idx = spans[:,None] - self.degree + np.arange(self.degree+1)
+        aders = np.einsum('mkj,mjc->kmc', ders, self.cpw[idx])
+        if not self.rational:
+            return aders[:,:,:3]
+        wders = aders[:,:,3:]
+        ck = np.empty_like(aders[:,:,:3])
+        for k in range(d+1):
+            v = aders[k,:,:3].copy()
+            for i in range(1, k+1):
+                v -= comb(k, i) * wders[i] * ck[k-i]
+            ck[k] = v / wders[0]
+        return ck
+
+    def values(self, u):
+        """Compute the points of the curve at parameters u (array of floats)
+        Returns an array of shape (len(u), 3)"""
+        return self.derivatives(u, 0)[0]
+
+class BsplineSurfaceEvaluator(object):
+    """Evaluates a BSpline surface, and its partial derivatives, on grids of parameters.
+    ev = BsplineSurfaceEvaluator(surface)
+    The surface is evaluated with two 1D basis tables, contracted with the poles grid.
+    Rational and periodic surfaces are supported."""
+    def __init__(self, surf):
+        self.ubasis = BsplineBasis()
+        self.ubasis.knots = list(surf.UKnotSequence)
+        self.ubasis.degree = surf.UDegree
+        self.vbasis = BsplineBasis()
+        self.vbasis.knots = list(surf.VKnotSequence)
+        self.vbasis.degree = surf.VDegree
+        self.rational = surf.isURational() or surf.isVRational()
+        poles = np.array(surf.getPoles(), dtype=float)
+        weights = np.array(surf.getWeights(), dtype=float)
+        nb_upoles = len(self.ubasis.knots) - self.ubasis.degree - 1
+        nb_vpoles = len(self.vbasis.knots) - self.vbasis.degree - 1
+        # periodic surface : wrap the poles
+        iu = np.arange(nb_upoles) % poles.shape[0]
+        iv = np.arange(nb_vpoles) % poles.shape[1]
+        poles = poles[iu][:,iv]
+        weights = weights[iu][:,iv]
+        # homogeneous poles
+        self.cpw = np.concatenate([poles * weights[:,:,None], weights[:,:,None]], axis=2)
+
+    def derivatives(self, u, v, d=2):
+        """Compute the points and partial derivatives of the surface on the grid u x v.
+        - input: parameters u and v (arrays of floats), derivative d (int)
+        - output: skl (array of floats, shape (d+1, d+1, len(u), len(v), 3))
+        skl[k,l] is the derivative of the surface, k times in U and l times in V.
+        Only the derivatives with k+l <= d are computed, the other ones are left null.
+        Nurbs Book Algo A3.6 p.111 and A4.4 p.137"""
+        uspans, uders = self.ubasis.evaluate_array(u, d)
+        vspans, vders = self.vbasis.evaluate_array(v, d)
+        pu = self.ubasis.degree
+        pv = self.vbasis.degree
+        # contraction in U direction : shape (len(u), d+1, nb_vpoles, 4)
+        iu = uspans[:,None] - pu + np.arange(pu+1)
+        tmp = np.einsum('mka,mavc->mkvc', uders, self.cpw[iu])
+        # contraction in V direction : shape (d+1, d+1, len(u), len(v), 4)
+        aders = np.zeros((d+1, d+1, len(uspans), len(vspans), 4))
+        for b in range(pv+1):
+            aders += np.einsum('nl,mknc->klmnc', vders[:,:,b], tmp[:,:,vspans-pv+b])
+        if not self.rational:
+            skl = aders[...,:3]
+            for k in range(d+1):
+                skl[k,d-k+1:] = 0.0
+            return skl
+        adr = aders[...,:3]
+        wdr = aders[...,3:]
+        skl = np.zeros_like(adr)
+        for k in range(d+1):
+            for l in range(d-k+1):
+                val = adr[k,l].copy()
+                for j in range(1, l+1):
+                    val -= comb(l, j) * wdr[0,j] * skl[k,l-j]
+                for i in range(1, k+1):
+                    val -= comb(k, i) * wdr[i,0] * skl[k-i,l]
+                    v2 = np.zeros_like(val)
+                    for j in range(1, l+1):
+                        v2 += comb(l, j) * wdr[i,j] * skl[k-i,l-j]
+                    val -= comb(k, i) * v2
+                skl[k,l] = val / wdr[0,0]
+        return skl
+
+    def values(self, u, v):
+        """Compute the points of the surface on the grid u x v
+        Returns an array of shape (len(u), len(v), 3)"""
+        return self.derivatives(u, v, 0)[0,0]
+
+    def normals(self, u, v):
+        """Compute the unit normals of the surface on the grid u x v
+        Returns an array of shape (len(u), len(v), 3)
+        Normals are null at degenerated points"""
+        skl = self.derivatives(u, v, 1)
+        nor = np.cross(skl[1,0], skl[0,1])
+        le = np.linalg.norm(nor, axis=-1, keepdims=True)
+        return np.divide(nor, le, out=np.zeros_like(nor), where=le > 1e-12)
+
+class CurveProjector(object):
+    """Projects points on a curve, with numpy.
+    cp = CurveProjector(curve_or_edge, samples=None)
+    The curve is converted to a BSpline restricted to its parameter range.
+    Each projection is seeded with the nearest segments of a polyline sampled on the curve,
+    and refined with Newton iterations.
+    For large sets of points, the nearest segments are searched around the nearest
+    polyline vertices, found with a KD-tree if scipy is available."""
+    def __init__(self, curve, samples=None):
+        if hasattr(curve, "Curve"): # edge
+            fp, lp = curve.ParameterRange
+            curve = curve.Curve
+        else:
+            fp, lp = curve.FirstParameter, curve.LastParameter
+        if not isinstance(curve, Part.BSplineCurve):
+            curve = curve.toBSpline(fp, lp)
+        self.evaluator = BsplineCurveEvaluator(curve)
+        self.first = fp
+        self.last = lp
+        if samples is None:
+            samples = max(16, 4 * self.evaluator.cpw.shape[0])
+        self.params = np.linspace(fp, lp, samples)
+        self.points = self.evaluator.values(self.params)
+        self._tree = None
+
+    @property
+    def tree(self):
+        """KD-tree of the polyline vertices (None if scipy is not available)"""
+        if self._tree is None and cKDTree is not None:
+            self._tree = cKDTree(self.points)
+        return self._tree
+
+    def _candidate_segments(self, pts, k=1):
+        """Returns the indices of the polyline segments that may be among the k nearest segments of each of pts.
+        The 2k nearest vertices touch at least k segments, so these segments are adjacent to
+        the vertices closer than the 2k-th nearest vertex plus half the longest segment.
+        Output : array of shape (n, c), padded with -1, or None without KD-tree"""
+        if self.tree is None:
+            return None
+        nb_seg = len(self.points) - 1
+        half = 0.5 * np.sqrt(np.max(np.sum(np.diff(self.points, axis=0)**2, axis=1)))
+        nv = min(2*k, len(self.points))
+        dmax = self.tree.query(pts, [nv])[0][:,0]
+        balls = self.tree.query_ball_point(pts, dmax + half * (1.0 + 1e-9) + 1e-15)
+        counts = np.array([len(b) for b in balls])
+        flat = np.concatenate([np.asarray(b, dtype=int) for b in balls])
+        rows = np.repeat(np.arange(len(pts)), counts)
+        cols = np.arange(len(flat)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cand = np.full((len(pts), 2 * counts.max()), -1, dtype=int)
+        cand[rows, 2*cols] = np.clip(flat - 1, 0, nb_seg - 1)
+        cand[rows, 2*cols+1] = np.clip(flat, 0, nb_seg - 1)
+        # neighbour vertices share segments
+        cand.sort(axis=1)
+        cand[:,1:][cand[:,1:] == cand[:,:-1]] = -1
+        return cand
+
+    def seed(self, pts, k=1):
+        """Returns the parameters of the projections of pts (array of shape (n,3))
+        on the k nearest segments of the sampled polyline.
+        Output : array of shape (n,k)"""
+        pts = np.asarray(pts, dtype=float).reshape(-1, 3)
+        a = self.points[:-1]
+        ab = self.points[1:] - a
+        ab2 = np.einsum('ij,ij->i', ab, ab)
+        k = min(k, len(a))
+        cand = None
+        if len(pts) * len(a) > 2**16:
+            cand = self._candidate_segments(pts, k)
+        width = len(a) if cand is None else cand.shape[1]
+        res = np.empty((len(pts), k))
+        chunk = max(1, 2**20 // width)
+        for i in range(0, len(pts), chunk):
+            p = pts[i:i+chunk]
+            if cand is None:
+                seg = np.broadcast_to(np.arange(len(a)), (len(p), len(a)))
+            else:
+                seg = cand[i:i+chunk]
+            valid = seg >= 0
+            seg = np.where(valid, seg, 0)
+            ap = p[:,None,:] - a[seg]
+            r = np.clip(np.divide(np.einsum('ijk,ijk->ij', ap, ab[seg]), ab2[seg], out=np.zeros(seg.shape), where=ab2[seg] > 0), 0.0, 1.0)
+            diff = ap - r[:,:,None] * ab[seg]
+            sqd = np.where(valid, np.einsum('ijk,ijk->ij', diff, diff), np.inf)
+            best = np.argpartition(sqd, min(k, width) - 1, axis=1)[:,:k]
+            seg = np.take_along_axis(seg, best, axis=1)
+            rs = np.take_along_axis(r, best, axis=1)
+            res[i:i+chunk] = self.params[seg] + rs * (self.params[seg+1] - self.params[seg])
+        return res
+
+    def refine(self, pts, t, iterations=20, tol=1e-12):
+        """Newton refinement of the projection parameters t (array) of the points pts (array of shape (len(t),3)).
+        Only the parameters that have not converged yet are updated at each iteration.
+        Returns parameters, foot points, and distances (arrays)"""
+        t0 = t.copy()
+        t = t.copy()
+        ptol = tol * (self.last - self.first)
+        active = np.arange(len(t))
+        for it in range(iterations):
+            ta = t[active]
+            ders = self.evaluator.derivatives(ta, 2)
+            diff = ders[0] - pts[active]
+            g = np.einsum('ij,ij->i', ders[1], diff)
+            d1 = np.einsum('ij,ij->i', ders[1], ders[1])
+            h = np.einsum('ij,ij->i', ders[2], diff) + d1
+            # Newton step, or Gauss-Newton step where the curve is not locally convex
+            h = np.where(h > 0, h, d1)
+            step = np.divide(g, h, out=np.zeros_like(g), where=h > 0)
+            nt = np.clip(ta - step, self.first, self.last)
+            t[active] = nt
+            active = active[np.abs(nt - ta) > ptol]
+            if len(active) == 0:
+                break
+        foot = self.evaluator.values(t)
+        dist = np.linalg.norm(foot - pts, axis=1)
+        # never do worse than the seed point
+        seed_pts = self.evaluator.values(t0)
+        seed_dist = np.linalg.norm(seed_pts - pts, axis=1)
+        worse = seed_dist < dist
+        t[worse] = t0[worse]
+        foot[worse] = seed_pts[worse]
+        dist[worse] = seed_dist[worse]
+        return t, foot, dist
+
+    def project(self, pts, seeds=3, iterations=20, tol=1e-12):
+        """Project the points pts (array of shape (n,3)) on the curve.
+        Each point is refined from its 'seeds' nearest polyline segments, and the best result is kept.
+        Returns parameters, foot points, and distances (arrays)"""
+        pts = np.asarray(pts, dtype=float).reshape(-1, 3)
+        t = self.seed(pts, seeds)
+        n, k = t.shape
+        tt, foot, dist = self.refine(np.repeat(pts, k, axis=0), t.ravel(), iterations, tol)
+        best = np.argmin(dist.reshape(n, k), axis=1) + k * np.arange(n)
+        return tt[best], foot[best], dist[best]
+
+    def distances(self, pts):
+        """Returns the distances of the points pts (array of shape (n,3)) to the curve"""
+        return self.project(pts)[2]
+
+def _span_derivative_bounds(evaluator):
+    """Upper bounds of the first and second derivatives of a BSpline curve on each knot span.
+    Returns arrays L1, L2, where L1[j] bounds |C'(t)| and L2[j] bounds |C''(t)|
+    for knots[j] <= t <= knots[j+1]
+    The bounds come from the hodograph poles of the homogeneous curve,
+    centered on the poles of each span (convex hull property)."""
+    p = evaluator.degree
+    knots = np.asarray(evaluator.basis.knots, dtype=float)
+    cpw = evaluator.cpw
+    nb = len(cpw)
+    L1 = np.zeros(len(knots) - 1)
+    L2 = np.zeros(len(knots) - 1)
+    if p < 1:
+        return L1, L2
+    span = knots[p+1:nb+p] - knots[1:nb]
+    hodo = np.divide(p, span, out=np.zeros_like(span), where=span > 0)[:,None] * np.diff(cpw, axis=0)
+    spans = np.arange(p, nb)
+    idx = spans[:,None] - p + np.arange(p+1)
+    w = cpw[idx,3]
+    pts = cpw[idx,:3] / w[:,:,None]
+    center = pts.mean(axis=1)
+    radius = np.linalg.norm(pts - center[:,None,:], axis=2).max(axis=1)
+    wmin = w.min(axis=1)
+    # hodograph poles of A(t) - w(t) * center, and of w(t)
+    hidx = idx[:,:-1]
+    dA = np.linalg.norm(hodo[hidx,:3] - hodo[hidx,3:] * center[:,None,:], axis=2).max(axis=1)
+    dw = np.abs(hodo[hidx,3]).max(axis=1)
+    # C' = (A' - w' C) / w
+    L1[spans] = (dA + dw * radius) / wmin
+    if p < 2:
+        return L1, L2
+    span = knots[p+1:nb+p-1] - knots[2:nb]
+    hodo2 = np.divide(p-1, span, out=np.zeros_like(span), where=span > 0)[:,None] * np.diff(hodo, axis=0)
+    hidx = idx[:,:-2]
+    d2A = np.linalg.norm(hodo2[hidx,:3] - hodo2[hidx,3:] * center[:,None,:], axis=2).max(axis=1)
+    d2w = np.abs(hodo2[hidx,3]).max(axis=1)
+    # C'' = (A'' - 2 w' C' - w'' C) / w
+    L2[spans] = (d2A + 2.0 * dw * L1[spans] + d2w * radius) / wmin
+    return L1, L2
+
+def _directed_hausdorff(proj_a, proj_b, tol, rtol, samples, max_evals, batch=256):
+    """Best-first branch and bound search of the largest distance from curve A to curve B.
+    The intervals are kept in a heap, ordered by their upper bound, and up to 'batch' intervals
+    of largest bound are bisected together, until the largest bound is within tol + rtol * dist
+    of the current maximum, or max_evals distances have been computed.
+    Returns the distance, its parameter on A, and an upper bound of the true value"""
+    ev = proj_a.evaluator
+    fp, lp = proj_a.first, proj_a.last
+    L1, L2 = _span_derivative_bounds(ev)
+    evb = proj_b.evaluator
+    B2 = _span_derivative_bounds(evb)[1]
+    M2 = B2.max()
+    knots = np.asarray(ev.basis.knots, dtype=float)
+    t = np.unique(np.concatenate((np.linspace(fp, lp, samples), knots[(knots > fp) & (knots < lp)])))
+    s, foot, f = proj_b.project(ev.values(t))
+    evals = len(t)
+    i = int(np.argmax(f))
+    dist, param = float(f[i]), float(t[i])
+    def bounds(a, b, fa, fb, sa, sb):
+        h = b - a
+        spans = ev.basis.find_spans(0.5 * (a + b))
+        # distance to B is 1-Lipschitz, so f is L1-Lipschitz on the interval
+        lip = 0.5 * (fa + fb + L1[spans] * h)
+        # f(t) <= |A(t) - B(s(t))|, with s linear between the foot parameters sa and sb.
+        # The norm of this vector is convex along the chord, and the vector
+        # deviates from its chord by at most h^2 / 8 * max |d2/dt2 (A(t) - B(s(t)))|
+        ds = np.divide(sb - sa, h, out=np.zeros_like(h), where=h > 0)
+        ja = evb.basis.find_spans(np.minimum(sa, sb))
+        jb = evb.basis.find_spans(np.maximum(sa, sb))
+        m2 = np.where(jb - ja > 1, M2, np.maximum(B2[ja], B2[jb]))
+        quad = np.maximum(fa, fb) + h**2 / 8.0 * (L2[spans] + m2 * ds**2)
+        return np.minimum(lip, quad)
+    items = zip(bounds(t[:-1], t[1:], f[:-1], f[1:], s[:-1], s[1:]), t[:-1], t[1:], f[:-1], f[1:], s[:-1], s[1:])
+    heap = [(-item[0],) + item[1:] for item in items]
+    heapq.heapify(heap)
+    # largest bound of the intervals dropped because they can't beat the maximum
+    dropped = dist
+    while heap and evals < max_evals:
+        if -heap[0][0] - dist <= tol + rtol * dist:
+            break
+        nb = min(batch, max_evals - evals)
+        popped = list()
+        while heap and len(popped) < nb and -heap[0][0] - dist > tol + rtol * dist:
+            popped.append(heapq.heappop(heap))
+        a, b, fa, fb, sa, sb = [np.array([it[k] for it in popped]) for k in range(1, 7)]
+        m = 0.5 * (a + b)
+        sm, foot, fm = proj_b.project(ev.values(m))
+        evals += len(m)
+        i = int(np.argmax(fm))
+        if fm[i] > dist:
+            dist, param = float(fm[i]), float(m[i])
+        a, b = np.concatenate((a, m)), np.concatenate((m, b))
+        fa, fb = np.concatenate((fa, fm)), np.concatenate((fm, fb))
+        sa, sb = np.concatenate((sa, sm)), np.concatenate((sm, sb))
+        upper = bounds(a, b, fa, fb, sa, sb)
+        for item in zip(upper, a, b, fa, fb, sa, sb):
+            if item[0] - dist > tol + rtol * dist:
+                heapq.heappush(heap, (-item[0],) + item[1:])
+            else:
+                dropped = max(dropped, float(item[0]))
+    if heap:
+        return dist, param, max(dist, dropped, float(-heap[0][0]))
+    return dist, param, max(dist, dropped)
+
+def hausdorff_distance(c1, c2, tol=1e-6, rtol=1e-3, samples=50, max_evals=2000):
+    """Two-sided Hausdorff distance between two curves or edges.
+    dist, (pt1, pt2), bound = hausdorff_distance(c1, c2, tol=1e-6, rtol=1e-3, samples=50, max_evals=2000)
+    Each curve is bracketed with 'samples' points and its knots, and the intervals
+    where the distance bound may exceed the current maximum are subdivided, largest bound first.
+    pt1 is the point of one curve at the distance dist from the other curve, pt2 is its projection.
+    bound is an upper bound of the Hausdorff distance, assuming the projections find the nearest points.
+    It is within tol + rtol * dist of dist, unless max_evals distances (per direction) were needed:
+    then the search stops, and bound is the best certified value at that point."""
+    proj1 = CurveProjector(c1)
+    proj2 = CurveProjector(c2)
+    d12, t1, b12 = _directed_hausdorff(proj1, proj2, tol, rtol, samples, max_evals)
+    d21, t2, b21 = _directed_hausdorff(proj2, proj1, tol, rtol, samples, max_evals)
+    if d12 >= d21:
+        pt = proj1.evaluator.values([t1])
+        foot = proj2.project(pt)[1]
+    else:
+        pt = proj2.evaluator.values([t2])
+        foot = proj1.project(pt)[1]
+    return max(d12, d21), (pt[0], foot[0]), max(b12, b21)
+
+def points_array(pts):
+    """Returns an array of shape (n,dim) from pts
+    pts can be an array, a list of FreeCAD.Vector, or a list of FreeCAD.Base.Vector2d"""
+    if isinstance(pts, np.ndarray):
+        return pts.astype(float)
+    if len(pts) and isinstance(pts[0], FreeCAD.Base.Vector2d):
+        return np.array([[p.x, p.y] for p in pts], dtype=float)
+    return np.array(pts, dtype=float)
+
+def parameterization_array(pts, fac=1.0, closed=False, normalize=False):
+    """Computes the parameters of a set of points
+    params = parameterization_array(pts, fac=1.0, closed=False, normalize=False)
+    pts : array of shape (n,dim), or list of FreeCAD.Vector, or list of FreeCAD.Base.Vector2d
+    fac : parameterization exponent of the distances between points
+          fac=0 -> Uniform / fac=0.5 -> Centripetal / fac=1.0 -> Chord-Length
+    closed : if True, a last parameter is added for the closing segment (pts is not modified)
+    normalize : if True, parameters are scaled to the [0, 1] range
+    Output : array of parameters, starting at 0.0"""
+    arr = points_array(pts)
+    if closed: # we need to add the first point as the end point
+        arr = np.concatenate([arr, arr[:1]])
+    lengths = np.linalg.norm(np.diff(arr, axis=0), axis=1) ** fac
+    params = np.concatenate([[0.0], np.cumsum(lengths)])
+    if normalize and params[-1] > 0:
+        params /= params[-1]
+    return params
+
 def parameterization(pts, fac=1.0, closed=False):
     # Computes a knot Sequence for a set of points
     # fac (0-1) : parameterization factor
     # fac=0 -> Uniform / fac=0.5 -> Centripetal / fac=1.0 -> Chord-Length
-    if closed: # we need to add the first point as the end point
-        pts.append(pts[0])
-    params = [0]
-    for i in range(1,len(pts)):
-        p = pts[i]-pts[i-1]
-        if isinstance(p,FreeCAD.Vector):
-            l = p.Length
-        else:
-            l = p.length()
-        pl = pow(l,fac)
-        params.append(params[-1] + pl)
-    return params
+    # see parameterization_array
+    return parameterization_array(pts, fac, closed).tolist()
 
-# This KnotVector class is equivalent to the following knotSeq* functions
-# I am not sure what is best: a class or a set of independent functions ?
+# The knotSeq* functions below mirror the KnotVector methods for plain lists and arrays.
+# Use a KnotVector to modify a knot vector in place.
 
 class KnotVector(object):
-    """Knot vector object to use in Bsplines"""
-    def __init__(self, v=[0.0, 1.0]):
-        self._vector = v
-        self._min_max()
+    """Knot vector object to use in Bsplines
+    kv = KnotVector([0.0, 0.0, 1.0, 1.0])
+    The knots are stored, sorted, in a float64 array, that is modified in place.
+    The unique knots, multiplicities and span index are cached until the next modification."""
+    __slots__ = ("_vector", "_uniq", "_span_index")
+
+    def __init__(self, v=None):
+        if v is None:
+            v = [0.0, 1.0]
+        self.vector = v
 
     def __repr__(self):
-        return "KnotVector(%s)"%str(self._vector)
+        return "KnotVector(%s)"%str(self._vector.tolist())
 
     @property
     def vector(self):
@@ -308,41 +1154,47 @@ class KnotVector(object):
 
     @vector.setter
     def vector(self, v):
-        self._vector = v
-        self._vector.sort()
-        self._min_max()
+        self._vector = np.sort(np.array(v, dtype=float))
+        self._modified()
 
-    def _min_max(self):
-        """Compute the min and max values of the knot vector"""
-        self.maxi = max(self._vector)
-        self.mini = min(self._vector)
+    def _modified(self):
+        """Clear the cached data"""
+        self._uniq = None
+        self._span_index = None
+
+    @property
+    def maxi(self):
+        return self._vector[-1]
+
+    @property
+    def mini(self):
+        return self._vector[0]
 
     def reverse(self):
         """Reverse the knot vector"""
-        newknots = [(self.maxi + self.mini - k) for k in self._vector]
-        newknots.reverse()
-        self._vector = newknots
+        v = self._vector
+        np.subtract(v[0] + v[-1], v[::-1], out=v)
+        self._modified()
 
     def normalize(self):
         """Normalize the knot vector"""
         self.scale()
 
-    def scale(self, length=1.0):
+    def scale(self, length=1.0, start=0.0):
         """Scales the knot vector to a given length"""
         if length <= 0.0:
             error("scale error : bad value")
         else:
-            ran = self.maxi - self.mini
-            newknots = [length * (k-self.mini)/ran for k in self._vector]
-            self._vector = newknots
-            self._min_max()
+            v = self._vector
+            ran = v[-1] - v[0]
+            v -= v[0]
+            v *= length / ran
+            v += start
+            self._modified()
 
     def reversed_param(self, pa):
         """Returns the image of the parameter when the knot vector is reversed"""
-        newvec = KnotVector()
-        newvec.vector = [self._vector[0], pa, self._vector[-1]]
-        newvec.reverse()
-        return newvec.vector[1]
+        return self.mini + self.maxi - pa
 
     def create_uniform(self, degree, nb_poles):
         """Create a uniform knotVector from given degree and Nb of poles"""
@@ -350,58 +1202,78 @@ class KnotVector(object):
             error("create_uniform : degree >= nb_poles")
         else:
             nb_int_knots = nb_poles - degree - 1
-            start = [0.0 for k in range(degree+1)]
-            mid = [float(k) for k in range(1,nb_int_knots+1)]
-            end = [float(nb_int_knots+1) for k in range(degree+1)]
-            self._vector = start + mid + end
-            self._min_max()
+            self._vector = np.concatenate([np.zeros(degree),
+                                           np.arange(nb_int_knots + 2, dtype=float),
+                                           np.full(degree, float(nb_int_knots + 1))])
+            self._modified()
+
+    def _unique(self):
+        if self._uniq is None:
+            knots, mults = np.unique(self._vector, return_counts=True)
+            knots.setflags(write=False)
+            mults.setflags(write=False)
+            self._uniq = (knots, mults)
+        return self._uniq
+
+    @property
+    def knots(self):
+        """Read-only array of the unique knots"""
+        return self._unique()[0]
+
+    @property
+    def mults(self):
+        """Read-only array of the multiplicities"""
+        return self._unique()[1]
 
     def get_mults(self):
         """Get the list of multiplicities of the knot vector"""
-        no_duplicates = list(set(self._vector))
-        return [self._vector.count(k) for k in no_duplicates]
+        return self.mults.tolist()
 
     def get_knots(self):
         """Get the list of unique knots, without duplicates"""
-        return list(set(self._vector))
+        return self.knots.tolist()
+
+    def find_span(self, u, degree):
+        """Returns the knot span index of parameter u, for a given degree"""
+        if (self._span_index is None) or (not self._span_index.degree == degree):
+            self._span_index = SpanIndex(self._vector.copy(), degree)
+        return self._span_index.find(u)
 
 # ---------------------------------------------------
 
 def knotSeqReverse(knots):
     """Reverse a knot vector
-    revKnots = knotSeqReverse(knots)"""
-    ma = max(knots)
-    mi = min(knots)
-    newknots = [ma+mi-k for k in knots]
-    newknots.reverse()
-    return newknots
+    revKnots = knotSeqReverse(knots)
+    knots is a sorted list or numpy array, the result has the same type.
+    Use KnotVector.reverse to reverse in place."""
+    su = knots[0] + knots[-1]
+    if isinstance(knots, np.ndarray):
+        return su - knots[::-1]
+    return [su - k for k in reversed(knots)]
 
 def knotSeqNormalize(knots):
     """Normalize a knot vector
     normKnots = knotSeqNormalize(knots)"""
-    ma = max(knots)
-    mi = min(knots)
-    ran = ma-mi
-    newknots = [(k-mi)/ran for k in knots]
-    return newknots
+    return knotSeqScale(knots)
 
 def knotSeqScale(knots, length = 1.0, start = 0.0):
     """Scales a knot vector to a given length
-    newknots = knotSeqScale(knots, length = 1.0)"""
+    newknots = knotSeqScale(knots, length = 1.0)
+    knots is a sorted list or numpy array, the result has the same type.
+    Use KnotVector.scale to scale in place."""
     if length <= 0.0:
         error("knotSeqScale : length <= 0.0")
     else:
-        ma = max(knots)
-        mi = min(knots)
-        ran = ma-mi
-        newknots = [start+(length*(k-mi)/ran) for k in knots]
-        return newknots
+        mi = knots[0]
+        fac = length / (knots[-1] - mi)
+        if isinstance(knots, np.ndarray):
+            return (knots - mi) * fac + start
+        return [start + fac * (k - mi) for k in knots]
 
 def paramReverse(pa,fp,lp):
     """Returns the image of parameter param when knot sequence [fp,lp] is reversed.
     newparam = paramReverse(param,fp,lp)"""
-    seq = [fp,pa,lp]
-    return knotSeqReverse(seq)[1]
+    return fp + lp - pa
 
 def createKnots(degree, nbPoles):
     """Create a uniform knotVector from given degree and Nb of poles
@@ -428,19 +1300,85 @@ def createKnotsMults(degree, nbPoles):
 
 # ---------------------------------------------------
 
+def nearest_parameters(bs, pts, samples=None):
+    """Projects many points on a curve, in one vectorized pass.
+    params, foot, dist = nearest_parameters(bs, pts, samples=None)
+    - bs : curve or edge
+    - pts : list of vectors, or array of shape (n,3)
+    - samples : number of points of the polyline used to seed the projections (see CurveProjector)
+    Returns arrays of the parameters, foot points and distances"""
+    pts = points_array(pts).reshape(-1, 3)
+    return CurveProjector(bs, samples).project(pts)
+
 def nearest_parameter(bs,pt):
     try:
         par = bs.parameter(pt)
     except Part.OCCError:
-        # failed. We try with distToShape
-        error("parameter error at %f"%par)
-        v = Part.Vertex(pt)
-        e = bs.toShape()
-        d,p,i = v.distToShape(e)
-        pt1 = p[0][1]
-        par = bs.parameter(pt1)
+        # failed. We try with a numpy projection
+        error("parameter error at {}\n".format(pt))
+        par = float(nearest_parameters(bs, [pt])[0][0])
     return par
 
+def refine_knot_vector(knots, degree, cpw, X):
+    """Insert the knots X in the knot sequence of a BSpline, in one pass.
+    new_knots, new_cpw = refine_knot_vector(knots, degree, cpw, X)
+    - knots : knot sequence (array of floats)
+    - cpw : homogeneous poles (array of shape (nb_poles, dim))
+    - X : knots to insert (array of floats), inside the knot range
+    Nurbs Book Algo A5.4 p.164"""
+    U = np.asarray(knots, dtype=float)
+    Pw = np.asarray(cpw, dtype=float)
+    X = np.sort(np.asarray(X, dtype=float))
+    p = degree
+    n = len(Pw) - 1
+    r = len(X) - 1
+    if r < 0:
+        return U.copy(), Pw.copy()
+    si = SpanIndex(U, p)
+    a = si.find(X[0])
+    b = si.find(X[r]) + 1
+    Qw = np.zeros((n + r + 2, Pw.shape[1]))
+    Ubar = np.zeros(len(U) + r + 1)
+    Qw[:a-p+1] = Pw[:a-p+1]
+    Qw[b+r:] = Pw[b-1:]
+    Ubar[:a+1] = U[:a+1]
+    Ubar[b+p+r+1:] = U[b+p:]
+    i = b + p - 1
+    k = b + p + r
+    for j in range(r, -1, -1):
+        while (X[j] <= U[i]) and (i > a):
+            Qw[k-p-1] = Pw[i-p-1]
+            Ubar[k] = U[i]
+            k -= 1
+            i -= 1
+        Qw[k-p-1] = Qw[k-p]
+        # the p affine combinations of the original loop only use the previous values
+        num = Ubar[k+1:k+p+1] - X[j]
+        den = Ubar[k+1:k+p+1] - U[i-p+1:i+1]
+        alfa = np.divide(num, den, out=np.zeros(p), where=(num != 0.0))[:,None]
+        old = Qw[k-p:k+1].copy()
+        Qw[k-p:k] = alfa * old[:-1] + (1.0 - alfa) * old[1:]
+        Ubar[k] = X[j]
+        k -= 1
+    return Ubar, Qw
+
+def refine_knots(bs, X):
+    """Insert all the knots X in the BSplineCurve bs, in one pass.
+    bs is rebuilt once, and returned.
+    refined_bs = refine_knots(bs, X)"""
+    if len(X) == 0:
+        return bs
+    if bs.isPeriodic():
+        bs.insertKnots(list(X), [1] * len(X), 0.0, True)
+        return bs
+    weights = np.array(bs.getWeights(), dtype=float)
+    cpw = np.hstack([np.array(bs.getPoles(), dtype=float) * weights[:,None], weights[:,None]])
+    flat, qw = refine_knot_vector(bs.KnotSequence, bs.Degree, cpw, X)
+    kv = KnotVector(flat)
+    poles = [FreeCAD.Vector(*p) for p in qw[:,:3] / qw[:,3:]]
+    bs.buildFromPolesMultsKnots(poles, kv.get_mults(), kv.get_knots(), False, bs.Degree, qw[:,3].tolist(), True)
+    return bs
+
 def insert_knots(bs, idx1, idx2, num):
     """For a BSPlineCurve bs, insert num knots between knots of index idx1 and idx2"""
     n = num + 1
@@ -451,9 +1389,273 @@ def insert_knots(bs, idx1, idx2, num):
     k1 = bs.getKnot(idx1)
     k2 = bs.getKnot(idx2)
     knot_range = k2 - k1
-    for i in range(1,n):
-        bs.insertKnot(k1 + i * knot_range / n)
-    return bs
+    return refine_knots(bs, k1 + np.arange(1, n) * knot_range / n)
+
+def remove_knot(knots, degree, cpw, r, s, num, tol):
+    """Try to remove num times the knot of index r, and multiplicity s, from a BSpline.
+    nb_removed, new_knots, new_cpw = remove_knot(knots, degree, cpw, r, s, num, tol)
+    - knots : knot sequence (array of floats)
+    - cpw : homogeneous poles (array of shape (nb_poles, dim))
+    - tol : maximum distance between the homogeneous poles before and after removal
+    Nurbs Book Algo A5.8 p.185"""
+    U = np.array(knots, dtype=float)
+    Pw = np.array(cpw, dtype=float)
+    p = degree
+    n = len(Pw) - 1
+    m = n + p + 1
+    order = p + 1
+    u = U[r]
+    fout = (2*r - s - p) // 2
+    last = r - s
+    first = r - p
+    temp = np.zeros((2*p + 1, Pw.shape[1]))
+    t = 0
+    while t < num:
+        off = first - 1
+        temp[0] = Pw[off]
+        temp[last+1-off] = Pw[last+1]
+        i = first
+        j = last
+        ii = 1
+        jj = last - off
+        while j - i > t:
+            alfi = (u - U[i]) / (U[i+order+t] - U[i])
+            alfj = (u - U[j-t]) / (U[j+order] - U[j-t])
+            temp[ii] = (Pw[i] - (1.0 - alfi) * temp[ii-1]) / alfi
+            temp[jj] = (Pw[j] - alfj * temp[jj+1]) / (1.0 - alfj)
+            i += 1
+            ii += 1
+            j -= 1
+            jj -= 1
+        if j - i < t:
+            remflag = np.linalg.norm(temp[ii-1] - temp[jj+1]) <= tol
+        else:
+            alfi = (u - U[i]) / (U[i+order+t] - U[i])
+            remflag = np.linalg.norm(Pw[i] - (alfi * temp[ii+t+1] + (1.0 - alfi) * temp[ii-1])) <= tol
+        if not remflag:
+            break
+        i = first
+        j = last
+        while j - i > t:
+            Pw[i] = temp[i-off]
+            Pw[j] = temp[j-off]
+            i += 1
+            j -= 1
+        first -= 1
+        last += 1
+        t += 1
+    if t == 0:
+        return 0, U, Pw
+    U[r+1-t:m+1-t] = U[r+1:m+1].copy()
+    j = fout
+    i = j
+    for k in range(1, t):
+        if k % 2 == 1:
+            i += 1
+        else:
+            j -= 1
+    Pw[j:j+n-i] = Pw[i+1:n+1].copy()
+    return t, U[:m+1-t], Pw[:n+1-t]
+
+def _evaluator_from_arrays(knots, degree, cpw):
+    """Returns a BsplineCurveEvaluator of a non-periodic BSpline given by arrays"""
+    return BsplineCurveEvaluator({"KnotSequence": knots,
+                                  "Degree": degree,
+                                  "Poles": cpw[:,:3] / cpw[:,3:],
+                                  "Weights": cpw[:,3],
+                                  "isRational": bool(np.any(np.abs(cpw[:,3] - cpw[0,3]) > 1e-12))})
+
+def compress_curve(bs, tol=1e-7, samples=20):
+    """Remove the knots of BSplineCurve bs that are not needed, within a 3D tolerance.
+    new_curve, report = compress_curve(bs, tol=1e-7, samples=20)
+    Knot removals (Nurbs Book A5.8) are repeated over all the interior knots, until none can be removed.
+    Each removal is then checked against 'samples' points per knot span of the original curve,
+    so the result stays within tol of the original curve.
+    report is a dictionary with keys : Poles (before, after), MaxDeviation"""
+    nb_poles = bs.NbPoles
+    if bs.isPeriodic():
+        return bs.copy(), {"Poles": (nb_poles, nb_poles), "MaxDeviation": 0.0}
+    p = bs.Degree
+    weights = np.array(bs.getWeights(), dtype=float)
+    poles = np.array(bs.getPoles(), dtype=float)
+    U = np.array(bs.KnotSequence, dtype=float)
+    cpw = np.hstack([poles * weights[:,None], weights[:,None]])
+    # tolerance on homogeneous poles (Nurbs Book eq. 5.30)
+    htol = tol * weights.min() / (1.0 + np.linalg.norm(poles, axis=1).max())
+    kv = KnotVector(U)
+    params = np.concatenate([np.linspace(a, b, samples, endpoint=False) for a, b in zip(kv.knots[:-1], kv.knots[1:])] + [kv.knots[-1:]])
+    ref = _evaluator_from_arrays(U, p, cpw).values(params)
+    deviation = 0.0
+    removed = True
+    while removed:
+        removed = False
+        kv = KnotVector(U)
+        # interior knots, last one first, so that the indices of the previous ones stay valid
+        for knot, mult in zip(kv.knots[-2:0:-1], kv.mults[-2:0:-1]):
+            r = int(np.searchsorted(U, knot, side='right')) - 1
+            t, nU, ncpw = remove_knot(U, p, cpw, r, int(mult), int(mult), htol)
+            while t > 0:
+                dev = np.linalg.norm(_evaluator_from_arrays(nU, p, ncpw).values(params) - ref, axis=1).max()
+                if dev <= tol:
+                    U, cpw = nU, ncpw
+                    deviation = max(deviation, float(dev))
+                    removed = True
+                    break
+                # too far : try to remove one knot less
+                t, nU, ncpw = remove_knot(U, p, cpw, r, int(mult), t-1, htol)
+    kv = KnotVector(U)
+    new_poles = [FreeCAD.Vector(*v) for v in cpw[:,:3] / cpw[:,3:]]
+    nc = Part.BSplineCurve()
+    nc.buildFromPolesMultsKnots(new_poles, kv.get_mults(), kv.get_knots(), False, p, cpw[:,3].tolist(), True)
+    return nc, {"Poles": (nb_poles, len(cpw)), "MaxDeviation": deviation}
+
+def compress_curves(curves, tol=1e-7, samples=20):
+    """Remove the knots of a list of BSplineCurves, within a 3D tolerance.
+    new_curves, report = compress_curves(curves, tol=1e-7, samples=20)
+    report is a dictionary with keys : Poles (before, after) and MaxDeviation, for the whole list,
+    and Curves, the list of the reports of each curve (see compress_curve)"""
+    results = [compress_curve(c, tol, samples) for c in curves]
+    reports = [r[1] for r in results]
+    before = sum([r["Poles"][0] for r in reports])
+    after = sum([r["Poles"][1] for r in reports])
+    dev = max([r["MaxDeviation"] for r in reports] + [0.0])
+    message("compress_curves : {} poles -> {} poles, max deviation {}\n".format(before, after, dev))
+    return [r[0] for r in results], {"Poles": (before, after), "MaxDeviation": dev, "Curves": reports}
+
+def lsq_poles(basis, params, pts):
+    """Least-squares poles of a clamped BSpline curve approximating points.
+    poles = lsq_poles(basis, params, pts)
+    - basis : BsplineBasis of the curve
+    - params : parameter of each point (array of floats)
+    - pts : points to approximate (array of shape (m,3))
+    The first and last poles are fixed on the first and last points.
+    The banded normal equations are built from the nonzero basis functions."""
+    p = basis.degree
+    n = len(basis.knots) - p - 2
+    pts = np.asarray(pts, dtype=float)
+    spans, ders = basis.evaluate_array(params)
+    vals = ders[:,0,:].copy()
+    cols = spans[:,None] - p + np.arange(p+1)[None,:]
+    # move the fixed end poles to the right-hand side
+    res = pts - np.sum(vals * (cols == 0), axis=1)[:,None] * pts[0] - np.sum(vals * (cols == n), axis=1)[:,None] * pts[-1]
+    vals[(cols == 0) | (cols == n)] = 0.0
+    poles = np.zeros((n+1, pts.shape[1]))
+    poles[0] = pts[0]
+    poles[-1] = pts[-1]
+    if n < 2:
+        return poles
+    # upper band storage of the symmetric normal matrix
+    band = np.zeros((p+1, n+1))
+    for a in range(p+1):
+        for b in range(a, p+1):
+            np.add.at(band[p-b+a], cols[:,b], vals[:,a] * vals[:,b])
+    rhs = np.zeros((n+1, pts.shape[1]))
+    np.add.at(rhs, cols, vals[:,:,None] * res[:,None,:])
+    band = band[:,1:n]
+    rhs = rhs[1:n]
+    if solveh_banded is not None:
+        try:
+            poles[1:n] = solveh_banded(band, rhs)
+            return poles
+        except np.linalg.LinAlgError:
+            pass
+    # dense fallback, also used for spans without enough points
+    size = n - 1
+    mat = np.zeros((size, size))
+    for k in range(p+1):
+        idx = np.arange(k, size)
+        mat[idx-k, idx] = band[p-k, k:]
+        mat[idx, idx-k] = band[p-k, k:]
+    poles[1:n] = np.linalg.lstsq(mat, rhs, rcond=None)[0]
+    return poles
+
+def approximation_knots(params, degree, nb_poles):
+    """Knot sequence of a least-squares approximation, from the parameters of the points.
+    knots = approximation_knots(params, degree, nb_poles)
+    nb_poles parameters are picked evenly, and the knots are their averages (Nurbs Book eq. 9.8 p.365),
+    so that each span holds parameters and the normal equations are well conditioned."""
+    params = np.asarray(params, dtype=float)
+    sub = params[np.round(np.linspace(0, len(params) - 1, nb_poles)).astype(int)]
+    inner = np.convolve(sub, np.ones(degree) / degree, 'valid')[1:-1]
+    return np.concatenate(([params[0]] * (degree+1), inner, [params[-1]] * (degree+1)))
+
+def _fit_points(bb, params, pts, tol, corrections):
+    """Least-squares poles on the knots of basis bb, with up to 'corrections' Newton steps on the parameters.
+    Returns the poles, the corrected parameters, and the distances of the points to the curve"""
+    knots = np.asarray(bb.knots, dtype=float)
+    for i in range(corrections + 1):
+        poles = lsq_poles(bb, params, pts)
+        ev = _evaluator_from_arrays(knots, bb.degree, np.hstack((poles, np.ones((len(poles), 1)))))
+        ders = ev.derivatives(params, 2)
+        diff = ders[0] - pts
+        dist = np.linalg.norm(diff, axis=1)
+        if i == corrections or dist.max() <= tol:
+            break
+        # parameter correction : one Newton step towards the foot point of each inner point
+        num = np.sum(diff * ders[1], axis=1)
+        den = np.sum(ders[1] * ders[1], axis=1) + np.sum(diff * ders[2], axis=1)
+        step = np.where(den > 1e-12, num / np.where(den > 1e-12, den, 1.0), 0.0)
+        new_params = params.copy()
+        new_params[1:-1] = np.clip(params[1:-1] - step[1:-1], params[0], params[-1])
+        if np.any(np.diff(new_params) < 0):
+            break
+        params = new_params
+    return poles, params, dist
+
+def approximate_points(pts, params=None, degree=3, tol=1e-3, max_poles=None, corrections=2):
+    """Least-squares BSpline approximation of a set of points, within a tolerance.
+    curve, max_error = approximate_points(pts, params=None, degree=3, tol=1e-3, max_poles=None, corrections=2)
+    - pts : points to approximate (list of vectors, or array of shape (m,3))
+    - params : parameter of each point. Default is a normalized chord length parameterization.
+    Starting from a Bezier curve, knots are inserted in the middle of the spans
+    that exceed the tolerance, until all the points are within tol of the curve,
+    or max_poles (default : the number of points) is reached.
+    If a split leaves a span without points, or reaches max_poles, the knots are placed
+    from the parameters instead (see approximation_knots).
+    On each knot vector, the parameters are improved by up to 'corrections' Newton steps.
+    The curve goes through the first and last points. The fit with the smallest error is returned.
+    max_error is the largest distance between a point and the curve at its parameter."""
+    pts = points_array(pts)
+    if pts.shape[1] < 3:
+        pts = np.hstack((pts, np.zeros((len(pts), 3 - pts.shape[1]))))
+    if params is None:
+        params = parameterization_array(pts, 1.0, False, True)
+    params = np.asarray(params, dtype=float)
+    degree = max(1, min(degree, len(pts) - 1))
+    if max_poles is None:
+        max_poles = len(pts)
+    max_poles = max(degree + 1, min(max_poles, len(pts)))
+    bb = BsplineBasis()
+    bb.degree = degree
+    uniq = np.array([params[0], params[-1]])
+    best = None
+    while True:
+        knots = np.concatenate(([uniq[0]] * degree, uniq, [uniq[-1]] * degree))
+        bb.knots = knots
+        poles, params, dist = _fit_points(bb, params, pts, tol, corrections)
+        if best is None or dist.max() < best[0]:
+            best = (float(dist.max()), knots, poles)
+        if best[0] <= tol:
+            break
+        if len(poles) >= max_poles:
+            break
+        # split the spans that hold points out of tolerance
+        spans = np.searchsorted(uniq, params[dist > tol], side='right') - 1
+        spans = np.unique(np.clip(spans, 0, len(uniq) - 2))
+        new_uniq = np.sort(np.concatenate((uniq, 0.5 * (uniq[spans] + uniq[spans+1]))))
+        nb_poles = len(new_uniq) + degree - 1
+        idx = np.clip(np.searchsorted(new_uniq, params, side='right') - 1, 0, len(new_uniq) - 2)
+        counts = np.bincount(idx, minlength=len(new_uniq) - 1)
+        if nb_poles >= max_poles or counts.min() == 0:
+            # empty spans make the fit singular : place the knots from the parameters
+            nb_poles = min(nb_poles, max_poles)
+            new_uniq = approximation_knots(params, degree, nb_poles)[degree:-degree]
+        uniq = new_uniq
+    max_error, knots, poles = best
+    kv = KnotVector(knots)
+    curve = Part.BSplineCurve()
+    curve.buildFromPolesMultsKnots([FreeCAD.Vector(*v) for v in poles], kv.get_mults(), kv.get_knots(), False, degree)
+    return curve, max_error
 
 def bspline_copy(bs, reverse = False, scale = 1.0):
     """Copy a BSplineCurve, with knotvector optionally reversed and scaled
@@ -461,84 +1663,252 @@ def bspline_copy(bs, reverse = False, scale = 1.0):
     mults = bs.getMultiplicities()
     weights = bs.getWeights()
     poles = bs.getPoles()
-    knots = bs.getKnots()
+    kv = KnotVector(bs.getKnots())
     perio = bs.isPeriodic()
     ratio = bs.isRational()
     if scale:
-        knots = knotSeqScale(knots, scale)
+        kv.scale(scale)
     if reverse:
         mults.reverse()
         weights.reverse()
         poles.reverse()
-        knots = knotSeqReverse(knots)
+        kv.reverse()
     bspline = Part.BSplineCurve()
-    bspline.buildFromPolesMultsKnots(poles, mults , knots, perio, bs.Degree, weights, ratio)
+    bspline.buildFromPolesMultsKnots(poles, mults , kv.vector.tolist(), perio, bs.Degree, weights, ratio)
     return bspline
 
-def curvematch(c1, c2, par1, level=0, scale=1.0):
-    '''Modifies the start of curve C2 so that it joins curve C1 at parameter par1
-    - level (integer) is the level of continuity at join point (C0, G1, G2, G3, etc)
-    - scale (float) is a scaling factor of the modified poles of curve C2
-    newC2 = curvematch(C1, C2, par1, level=0, scale=1.0)'''
+def match_poles(ders1, basis_ders2):
+    """Computes the leading poles of curves so that their derivatives match target values.
+    poles = match_poles(ders1, basis_ders2)
+    - ders1 : target derivatives 0 to level (array of shape (..., level+1, dim))
+    - basis_ders2 : derivatives 0 to level of the level+1 first basis functions
+      at the start of the curves (array of shape (..., level+1, level+1))
+    As derivative k only depends on the k+1 first poles, this is a lower triangular system.
+    Returns the level+1 first poles (array of shape (..., level+1, dim))"""
+    mat = np.tril(basis_ders2)
+    if np.any(np.abs(np.diagonal(mat, axis1=-2, axis2=-1)) < 1e-300):
+        raise np.linalg.LinAlgError("curvematch : zero basis derivative")
+    return np.linalg.solve(mat, ders1)
+
+def _scaled_derivatives(c1, par1, level, scale):
+    """Derivatives 0 to level of curve C1 at par1 (clamped to its range),
+    with the knot vector scaled to the length of C1, and reversed if scale < 0.
+    Returns an array of shape (level+1, 3)"""
     c1 = c1.toNurbs()
-    c2 = c2.toNurbs()
     len1 = c1.length()
-    #len2 = c2.length()
-    len2 = c2.EndPoint.distanceToPoint(c2.StartPoint)
-    # scale the knot vector of C2
-    seq2 = knotSeqScale(c2.KnotSequence, 1.0 * abs(scale) * len2)
-    # get a scaled / reversed copy of C1
+    fp, lp = c1.FirstParameter, c1.LastParameter
+    par = min(max(par1, fp), lp)
+    fac = (lp - fp) / len1
     if scale < 0:
-        bs1 = bspline_copy(c1, True, len1) # reversed
-    else:
-        bs1 = bspline_copy(c1, False, len1) # not reversed
-    if par1 <= c1.FirstParameter:
-        par = c1.FirstParameter
-    elif par1 >= c1.LastParameter:
-        par = c1.LastParameter
-    else:
-        par = par1
-    pt1 = c1.value(par) # point on input curve C1
-    npar = nearest_parameter(bs1,pt1)
-
-    p1 = bs1.getPoles()
-    basis1 = BsplineBasis()
-    basis1.knots = bs1.KnotSequence
-    basis1.degree = bs1.Degree
-    
-    p2 = c2.getPoles()
-    basis2 = BsplineBasis()
-    basis2.knots = seq2
+        fac = -fac
+    d1 = BsplineCurveEvaluator(c1).derivatives([par], level)[:,0,:]
+    return d1 * (fac ** np.arange(level+1))[:,None]
+
+def _curvematch_system(c1, c2, par1, level, scale, cache):
+    """Returns the target derivatives, the basis derivatives, the index of the first matched pole,
+    the level and C2 converted to a BSplineCurve, of one curvematch record"""
+    c2 = c2.toNurbs()
+    len2 = c2.EndPoint.distanceToPoint(c2.StartPoint)
+    if level > c2.Degree:
+        error("curvematch : continuity {} reduced to degree {}\n".format(level, c2.Degree))
+        level = c2.Degree
+    d1 = _scaled_derivatives(c1, par1, level, scale)
+    # basis functions of C2, with the knot vector scaled to scale * len2
+    kv = KnotVector(c2.KnotSequence)
+    kv.scale(abs(scale) * len2)
+    basis2 = BsplineBasis(cache)
+    basis2.knots = kv.vector
     basis2.degree = c2.Degree
-    
-    # Compute the (level+1) first poles of C2
-    l = 0
-    while l <= level:
-        #FreeCAD.Console.PrintMessage("\nDerivative %d\n"%l)
-        ev1 = basis1.evaluate(npar,d=l)
-        ev2 = basis2.evaluate(c2.FirstParameter,d=l)
-        #FreeCAD.Console.PrintMessage("Basis %d - %r\n"%(l,ev1))
-        #FreeCAD.Console.PrintMessage("Basis %d - %r\n"%(l,ev2))
-        poles1 = FreeCAD.Vector()
-        for i in range(len(ev1)):
-            poles1 += 1.0*ev1[i]*p1[i]
-        val = ev2[l]
-        if val == 0:
-            error("Zero !")
-            break
-        else:
-            poles2 = FreeCAD.Vector()
-            for i in range(l):
-                poles2 += 1.0*ev2[i]*p2[i]
-            np = (poles1-poles2)
-            np.multiply(1.0/val)
-            #FreeCAD.Console.PrintMessage("Moving P%d from (%0.2f,%0.2f,%0.2f) to (%0.2f,%0.2f,%0.2f)\n"%(l,p2[l].x,p2[l].y,p2[l].z,np.x,np.y,np.z))
-            p2[l] = np
-        l += 1
-    nc = c2.copy()
-    for i in range(len(p2)):
-        nc.setPole(i+1,p2[i])
-    return nc
+    spans, ders = basis2.evaluate_array([basis2.knots[0]], level)
+    first = int(spans[0]) - c2.Degree
+    return d1, ders[0,:,:level+1], first, level, c2
+
+def curvematch_many(records, cache=None):
+    """Batch version of curvematch.
+    new_curves = curvematch_many(records, cache=None)
+    records is a list of (c1, c2, par1, level, scale) tuples (see curvematch).
+    The matched poles of all the records of the same level are computed in one call to match_poles."""
+    if cache is None:
+        cache = basis_cache
+    systems = [_curvematch_system(*rec, cache) for rec in records]
+    results = [None] * len(records)
+    for level in set([s[3] for s in systems]):
+        idx = [i for i, s in enumerate(systems) if s[3] == level]
+        poles = match_poles(np.array([systems[i][0] for i in idx]), np.array([systems[i][1] for i in idx]))
+        for i, p in zip(idx, poles):
+            results[i] = p
+    new_curves = []
+    for sys, poles in zip(systems, results):
+        nc = sys[4].copy()
+        for i, p in enumerate(poles):
+            nc.setPole(sys[2] + i + 1, FreeCAD.Vector(*p))
+        new_curves.append(nc)
+    return new_curves
+
+def curvematch(c1, c2, par1, level=0, scale=1.0, cache=None):
+    '''Modifies the start of curve C2 so that it joins curve C1 at parameter par1
+    - level (integer) is the level of continuity at join point (C0, G1, G2, G3, etc)
+    - scale (float) is a scaling factor of the modified poles of curve C2
+    - cache (BasisCache) stores the basis tables. Defaults to the module basis_cache
+    newC2 = curvematch(C1, C2, par1, level=0, scale=1.0)'''
+    return curvematch_many([(c1, c2, par1, level, scale)], cache)[0]
+
+def match_ends(knots, poles, d1, d2, scale1=1.0, scale2=1.0, cache=None):
+    """Matches both ends of a curve to the derivatives of two curves, as curvematch does.
+    poles = match_ends(knots, poles, d1, d2, scale1=1.0, scale2=1.0, cache=None)
+    - knots, poles : flat knot sequence and poles (array of shape (..., n, 3)) of the base curve
+    - d1, d2 : derivatives 0 to cont1 and 0 to cont2 of the curves at the start and at the end of
+      the base curve, scaled as in curvematch (arrays of shape (..., cont1+1, 3) and (..., cont2+1, 3))
+    - scale1, scale2 : scaling factors of the matched poles (floats, or arrays of shape (...))
+    The leading dimensions stack curves that share the knot sequence : they are matched together.
+    The start is matched first, then the end, on the reversed curve.
+    The basis tables only depend on the normalized knot sequence, so they can be cached.
+    Returns the new poles"""
+    knots = np.asarray(knots, dtype=float)
+    poles = np.array(poles, dtype=float)
+    d1 = np.asarray(d1, dtype=float)
+    d2 = np.asarray(d2, dtype=float)
+    degree = len(knots) - poles.shape[-2] - 1
+    chord = np.linalg.norm(d2[...,0,:] - d1[...,0,:], axis=-1)
+    if np.any(chord < 1e-12):
+        raise ValueError("match_ends : coincident junction points")
+    knots = (knots - knots[0]) / (knots[-1] - knots[0])
+    basis = BsplineBasis(cache)
+    basis.degree = degree
+    for d, scale in ((d1, scale1), (d2, scale2)):
+        level = d.shape[-2] - 1
+        basis.knots = knots
+        spans, ders = basis.evaluate_array([0.0], level)
+        # knot vector scaled to scale * chord
+        fac = (np.abs(scale) * chord)[...,None] ** np.arange(level+1)
+        ders = ders[0,:,:level+1] / fac[...,:,None]
+        poles[...,:level+1,:] = match_poles(d, ders)
+        # reversed curve
+        knots = 1.0 - knots[::-1]
+        poles = poles[...,::-1,:].copy()
+    return poles
+
+def blend_poles(d1, d2, scale1=1.0, scale2=1.0, cache=None):
+    """Computes a blend curve from the derivatives of the two curves at the junctions.
+    knots, poles = blend_poles(d1, d2, scale1=1.0, scale2=1.0, cache=None)
+    - d1, d2 : derivatives 0 to cont1 and 0 to cont2 of the curves,
+      scaled as in curvematch (arrays of shape (..., cont1+1, 3) and (..., cont2+1, 3))
+    - scale1, scale2 : scaling factors of the matched poles (floats, or arrays of shape (...))
+    Same construction as blendCurve.compute : the line between the junction points,
+    of degree max(cont1, cont2) + 1, with a middle knot and cont1 and cont2 knots added
+    on each side, is matched at both ends with match_ends.
+    The knots only depend on cont1 and cont2, so stacked blends are computed together.
+    Only uses numpy, so it can run in a worker process.
+    Returns the flat knot sequence, on [0, 1], and the poles of the curves, from d2[0] to d1[0]"""
+    d1 = np.asarray(d1, dtype=float)
+    d2 = np.asarray(d2, dtype=float)
+    cont1, cont2 = d1.shape[-2] - 1, d2.shape[-2] - 1
+    degree = max(cont1, cont2) + 1
+    inner = np.concatenate((0.5 * np.arange(1, cont1+1) / (cont1+1),
+                            [0.5] * degree,
+                            0.5 + 0.5 * np.arange(1, cont2+1) / (cont2+1)))
+    knots = np.concatenate(([0.0] * (degree+1), inner, [1.0] * (degree+1)))
+    # a linear function has its poles on the Greville abscissae
+    greville = np.convolve(knots[1:-1], np.ones(degree) / degree, 'valid')
+    start = d1[...,None,0,:]
+    poles = start + greville[:,None] * (d2[...,None,0,:] - start)
+    poles = match_ends(knots, poles, d1, d2, scale1, scale2, cache)
+    return 1.0 - knots[::-1], poles[...,::-1,:]
+
+def _blend_task(args):
+    try:
+        return blend_poles(*args, cache=basis_cache)
+    except (ValueError, np.linalg.LinAlgError) as exc:
+        return exc
+
+def _pool_context(start_method="spawn"):
+    """Returns the multiprocessing context of the worker processes, or None if it can't be used.
+    spawn launches sys.executable, which is the FreeCAD binary inside FreeCAD,
+    so it is only used when sys.executable is a Python interpreter.
+    fork is only used if no other thread runs : forking a multi-threaded process,
+    like the FreeCAD GUI, can deadlock the child."""
+    import multiprocessing
+    import os
+    import sys
+    import threading
+    if start_method not in multiprocessing.get_all_start_methods():
+        error("start method {} is not available, computing in the main process\n".format(start_method))
+        return None
+    if start_method == "fork":
+        if threading.active_count() > 1:
+            error("fork start method refused : {} threads are running, computing in the main process\n".format(threading.active_count()))
+            return None
+    elif not os.path.basename(sys.executable).lower().startswith("python"):
+        error("{} start method needs a Python interpreter, not {}, computing in the main process\n".format(start_method, sys.executable))
+        return None
+    return multiprocessing.get_context(start_method)
+
+def _pool_map(func, tasks, processes, start_method="spawn"):
+    """Map func on tasks in a pool of worker processes, started with start_method (see _pool_context).
+    Returns the list of the results, or None if the pool can't be used."""
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    ctx = _pool_context(start_method)
+    if ctx is None:
+        return None
+    try:
+        with ProcessPoolExecutor(processes, mp_context=ctx) as pool:
+            return list(pool.map(func, tasks, chunksize=max(1, len(tasks) // (4 * processes))))
+    except (OSError, RuntimeError, BrokenProcessPool) as exc:
+        error("worker processes failed ({}), computing in the main process\n".format(exc))
+        return None
+
+def blend_curves(records, processes=None, start_method="spawn"):
+    """Computes many blend curves at once.
+    curves = blend_curves(records, processes=None, start_method="spawn")
+    records is a list of (edge1, param1, edge2, param2, continuity, scale) tuples,
+    continuity is an integer or a (cont1, cont2) pair, and scale a float or a (scale1, scale2) pair.
+    The junction derivatives are computed in the main process. The records of the same continuities
+    share their knots, so their blends are computed together, with one call to blend_poles.
+    This takes about 200 us per group, plus a few us per record. The groups are split
+    between 'processes' worker processes if given, started with start_method (see _pool_context).
+    Starting the pool takes much longer, so it only pays off on very large batches, outside of FreeCAD.
+    If the pool can't be used, the blends are computed in the main process.
+    Returns the list of the blend curves (same as blendCurve.Curve), with None for the failed records"""
+    groups = dict()
+    curves = [None] * len(records)
+    for i, (e1, p1, e2, p2, cont, scale) in enumerate(records):
+        cont1, cont2 = (cont, cont) if np.isscalar(cont) else cont
+        scale1, scale2 = (scale, scale) if np.isscalar(scale) else scale
+        c1 = e1.Curve.toBSpline(e1.FirstParameter, e1.LastParameter)
+        c2 = e2.Curve.toBSpline(e2.FirstParameter, e2.LastParameter)
+        d1 = _scaled_derivatives(c1, p1, int(cont1), scale1)
+        d2 = _scaled_derivatives(c2, p2, int(cont2), scale2)
+        if np.linalg.norm(d2[0] - d1[0]) < 1e-12:
+            error("blend_curves : record {} failed (coincident junction points)\n".format(i))
+            continue
+        groups.setdefault((int(cont1), int(cont2)), []).append((i, d1, d2, scale1, scale2))
+    # one task per group, or per chunk of group with a pool
+    size = max(1, -(-len(records) // processes)) if processes else len(records)
+    indices = []
+    tasks = []
+    for group in groups.values():
+        for k in range(0, len(group), size):
+            chunk = group[k:k+size]
+            indices.append([rec[0] for rec in chunk])
+            tasks.append(tuple(np.array([rec[j] for rec in chunk]) for j in range(1, 5)))
+    results = None
+    if processes and tasks:
+        results = _pool_map(_blend_task, tasks, processes, start_method)
+    if results is None:
+        results = [_blend_task(t) for t in tasks]
+    for idx, res in zip(indices, results):
+        if isinstance(res, Exception):
+            error("blend_curves : records {} failed ({})\n".format(idx, res))
+            continue
+        knots, poles = res
+        kv = KnotVector(knots)
+        degree = len(knots) - poles.shape[1] - 1
+        for i, pts in zip(idx, poles):
+            bs = Part.BSplineCurve()
+            bs.buildFromPolesMultsKnots([FreeCAD.Vector(*p) for p in pts], kv.get_mults(), kv.get_knots(), False, degree)
+            curves[i] = bs
+    return curves
 
 class blendCurve(object):
     def __init__(self, e1 = None, e2 = None):
@@ -591,31 +1961,55 @@ class blendCurve(object):
             #error("error : chordLength < 1e-6")
             #self.chordLength = 1.0
 
-    # doesn't work
-    #def autoscale(self, w1, w2, w3, maxscale, numsteps):
-        #minscale = .01
-        #best = 1e50
-        #res = None
-        #old_scale1 = self.scale1
-        #old_scale2 = self.scale2
-        #sign1 = self.scale1 / abs(self.scale1)
-        #sign2 = self.scale2 / abs(self.scale2)
-        #r = [minscale + float(i)*(maxscale-minscale)/(numsteps-1) for i in range(numsteps)]
-        #for s1 in r:
-            #for s2 in r:
-                #self.scale1 = sign1 * s1
-                #self.scale2 = sign2 * s2
-                #self.compute()
-                #a,b,c = eval_smoothness(self.shape(), samples=10)
-                #score = a*w1 + b*w2 + c*w3
-                #if score < best:
-                    #best = score
-                    #res = (self.scale1, self.scale2)
-        #self.scale1 = old_scale1
-        #self.scale2 = old_scale2
-        #return res
-
-    def compute(self):
+    def autoscale(self, w1=1.0, w2=1.0, w3=1.0, maxscale=3.0, numsteps=5, levels=4, samples=20):
+        """Search the scales that give the smoothest blend curve.
+        (scale1, scale2) = blendCurve.autoscale(w1=1.0, w2=1.0, w3=1.0, maxscale=3.0, numsteps=5, levels=4, samples=20)
+        The score of a blend curve is w1 * length_score + w2 * tangent_score + w3 * curvature_score (see eval_smoothness).
+        A grid of numsteps x numsteps scales is searched, then refined around the best one, 'levels' times.
+        The base curve is computed once, and each candidate is matched and scored with numpy only.
+        The signs of the current scales are kept. The blend curve is not recomputed.
+        Returns None if levels < 1 or numsteps < 2."""
+        if levels < 1 or numsteps < 2:
+            error("autoscale : levels must be >= 1 and numsteps >= 2")
+            return None
+        minscale = .01
+        sign1 = -1.0 if self.scale1 < 0 else 1.0
+        sign2 = -1.0 if self.scale2 < 0 else 1.0
+        base = self._base_curve()
+        knots = np.array(base.KnotSequence, dtype=float)
+        poles = np.array(base.getPoles(), dtype=float)
+        # the matching reverses the base curve twice, so knots and poles keep their order
+        d1 = _scaled_derivatives(self.edge1, self.param1, self.cont1, sign1)
+        d2 = _scaled_derivatives(self.edge2, self.param2, self.cont2, sign2)
+        basis = BsplineBasis(basis_cache)
+        basis.knots = (knots - knots[0]) / (knots[-1] - knots[0])
+        basis.degree = base.Degree
+        params, jac, h = _smoothness_params(0.0, 1.0, samples)
+        spans, ders = basis.evaluate_array(params, 2)
+        idx = spans[:,None] - base.Degree + np.arange(base.Degree+1)
+        def score(s1, s2):
+            cp = match_ends(knots, poles, d1, d2, sign1 * s1, sign2 * s2, basis_cache)
+            a, b, c = _smoothness_scores(np.einsum('mkj,mjc->kmc', ders, cp[idx]), jac, h)
+            return a * w1 + b * w2 + c * w3
+        lo = np.array([minscale, minscale])
+        hi = np.array([maxscale, maxscale])
+        best = None
+        for level in range(levels):
+            r1 = np.linspace(lo[0], hi[0], numsteps)
+            r2 = np.linspace(lo[1], hi[1], numsteps)
+            for s1 in r1:
+                for s2 in r2:
+                    sc = score(s1, s2)
+                    if best is None or sc < best[0]:
+                        best = (sc, s1, s2)
+            step = (hi - lo) / (numsteps - 1)
+            center = np.array(best[1:])
+            lo = np.maximum(minscale, center - step)
+            hi = np.minimum(maxscale, center + step)
+        return (float(sign1 * best[1]), float(sign2 * best[2]))
+
+    def _base_curve(self):
+        """Returns the curve between the two junction points, before matching"""
         v1 = self.edge1.value(self.param1)
         v2 = self.edge2.value(self.param2)
         degree = max(self.cont1, self.cont2) + 1
@@ -629,7 +2023,10 @@ class blendCurve(object):
             be.insertKnot(mid)
         be.increaseDegree(degree)
         nbs = insert_knots(be,1,2,self.cont1)
-        nnbs = insert_knots(nbs,-2,-1,self.cont2)
+        return insert_knots(nbs,-2,-1,self.cont2)
+
+    def compute(self):
+        nnbs = self._base_curve()
         nc = curvematch(self.edge1, nnbs, self.param1, self.cont1, self.scale1)
         rev = bspline_copy(nc, True, False)
         self.Curve = curvematch(self.edge2, rev, self.param2, self.cont2, self.scale2)
@@ -669,11 +2066,7 @@ class blendCurve(object):
         return Part.Wire(Part.__sortEdges__(self.getEdges()))
     
     def getJoinedCurve(self):
-        c = self.getCurves()
-        c0 = c[0]
-        for cu in c[1:]:
-            c0.join(cu)
-        return c0
+        return join_curves(self.getCurves())
 
     def shape(self):
         if self.Curve:
@@ -704,56 +2097,120 @@ def move_param(c,p1,p2):
 
 def move_params(c,p1,p2):
     curves = list()
-    p1.insert(0,c.FirstParameter)
-    p1.append(c.LastParameter)
-    p2.insert(0,c.FirstParameter)
-    p2.append(c.LastParameter)
+    p1 = [c.FirstParameter] + list(p1) + [c.LastParameter]
+    p2 = [c.FirstParameter] + list(p2) + [c.LastParameter]
     for i in range(len(p1)-1):
         c1 = c.copy()
         c1.segment(p2[i],p2[i+1])
         knots1 = knotSeqScale(c1.getKnots(), p1[i+1]-p1[i], p1[i])
-        print("%s -> %s"%(c1.getKnots(),knots1))
         c1.setKnots(knots1)
         curves.append(c1)
     return curves
 
+def remap_params(c, src, dst, tol=1e-9):
+    """Reparametrize a BSplineCurve with a piecewise linear map of its parameters.
+    newcurve = remap_params(curve, src, dst, tol=1e-9)
+    src, dst : increasing lists of parameters. Parameter src[i] of curve becomes parameter dst[i].
+    The curve range is kept : first and last parameters are added to src and dst.
+    The curve is made C0 at the src parameters (knot multiplicity = degree),
+    with a single knot insertion call, then all the knots are mapped in one pass."""
+    fp, lp = c.FirstParameter, c.LastParameter
+    src = np.concatenate([[fp], np.asarray(src, dtype=float), [lp]])
+    dst = np.concatenate([[fp], np.asarray(dst, dtype=float), [lp]])
+    if np.any(np.diff(src) <= 0) or np.any(np.diff(dst) <= 0):
+        error("remap_params : parameters must be increasing, and inside the curve range")
+        return None
+    nc = c.copy()
+    knots = np.array(nc.getKnots(), dtype=float)
+    mults = nc.getMultiplicities()
+    # snap the src parameters to the existing knots
+    idx = np.clip(np.searchsorted(knots, src), 1, len(knots)-1)
+    near = np.where(np.abs(knots[idx-1] - src) < np.abs(knots[idx] - src), idx-1, idx)
+    snap = np.abs(knots[near] - src) <= tol * (lp - fp)
+    src[snap] = knots[near[snap]]
+    ins_knots = []
+    ins_mults = []
+    for u, i, sn in zip(src[1:-1], near[1:-1], snap[1:-1]):
+        m = nc.Degree - (mults[i] if sn else 0)
+        if m > 0:
+            ins_knots.append(float(u))
+            ins_mults.append(int(m))
+    if ins_knots:
+        nc.insertKnots(ins_knots, ins_mults, 0.0, True)
+    nc.setKnots(np.interp(nc.getKnots(), src, dst).tolist())
+    return nc
+
 def join_curve(c1,c2):
+    """Join BSpline curve c2 at the end of BSpline curve c1
+    c = join_curve(c1,c2)"""
+    return join_curves([c1,c2])
+
+def join_curves(curves, tol=1e-7):
+    """Join a list of BSpline curves, in a single pass.
+    c = join_curves(curves, tol=1e-7)
+    Curves of lower degree are elevated to the highest degree.
+    Curves are reversed if needed, so that each one starts at the end of the previous one.
+    The knots of each curve are shifted to start at the last knot of the previous one,
+    and the junctions are C0 (knot multiplicity = degree).
+    Returns None if consecutive curves are farther than tol."""
+    degree = max([c.Degree for c in curves])
+    segs = []
+    for c in curves:
+        if c.Degree < degree:
+            c = c.copy()
+            c.increaseDegree(degree)
+        segs.append([np.array(c.getPoles(), dtype=float),
+                     np.array(c.getWeights(), dtype=float),
+                     np.array(c.getKnots(), dtype=float),
+                     c.getMultiplicities()])
+    def reverse(seg):
+        poles, weights, knots, mults = seg
+        return [poles[::-1], weights[::-1], knots[0] + knots[-1] - knots[::-1], mults[::-1]]
+    def dist(p1, p2):
+        return np.linalg.norm(p1 - p2)
+    # check the orientations and the junctions
+    if len(segs) > 1:
+        first, second = segs[0][0], segs[1][0]
+        if min(dist(first[0], second[0]), dist(first[0], second[-1])) < min(dist(first[-1], second[0]), dist(first[-1], second[-1])):
+            segs[0] = reverse(segs[0])
+    for i in range(1, len(segs)):
+        end = segs[i-1][0][-1]
+        if dist(end, segs[i][0][-1]) < dist(end, segs[i][0][0]):
+            segs[i] = reverse(segs[i])
+        if dist(end, segs[i][0][0]) > tol:
+            error("join_curves : curves #{} and #{} are not connected".format(i-1, i))
+            return None
+    poles, weights, knots, mults = segs[0]
+    new_poles = [poles]
+    new_weights = [weights]
+    new_knots = [knots]
+    new_mults = list(mults)
+    for poles, weights, knots, mults in segs[1:]:
+        # rescale the weights so that they match at the junction
+        weights = weights * (new_weights[-1][-1] / weights[0])
+        new_poles.append(poles[1:])
+        new_weights.append(weights[1:])
+        new_knots.append(knots[1:] + (new_knots[-1][-1] - knots[0]))
+        new_mults[-1] = degree
+        new_mults.extend(mults[1:])
     c = Part.BSplineCurve()
     # poles (sequence of Base.Vector), [mults , knots, periodic, degree, weights (sequence of float), CheckRational]
-    new_poles = c1.getPoles()
-    new_poles.extend(c2.getPoles()[1:])
-    new_weights = c1.getWeights()
-    new_weights.extend(c2.getWeights()[1:])
-    new_mults = c1.getMultiplicities()[:-1]
-    new_mults.append(c1.Degree)
-    new_mults.extend(c2.getMultiplicities()[1:])
-    knots1 = c1.getKnots()
-    knots2 = [knots1[-1] + k for k in c2.getKnots()]
-    new_knots = knots1
-    new_knots.extend(knots2[1:])
-    print("poles   -> %r"%new_poles)
-    print("weights -> %r"%new_weights)
-    print("mults   -> %r"%new_mults)
-    print("knots   -> %r"%new_knots)
-    c.buildFromPolesMultsKnots(new_poles, new_mults, new_knots, False, c1.Degree, new_weights, True)
+    c.buildFromPolesMultsKnots([FreeCAD.Vector(*p) for p in np.concatenate(new_poles)],
+                               new_mults,
+                               np.concatenate(new_knots).tolist(),
+                               False,
+                               degree,
+                               np.concatenate(new_weights).tolist(),
+                               True)
     return c
 
-def join_curves(curves):
-    c0 = curves[0]
-    for c in curves[1:]:
-        c0 = join_curve(c0,c)
-    return c0
-
 def reparametrize(c, p1, p2):
-    '''Reparametrize a BSplineCurve so that parameter p1 is moved to p2'''
+    '''Reparametrize a BSplineCurve so that parameter p2 is moved to p1
+    p1 and p2 can be floats, or increasing lists of floats'''
     if not isinstance(p1,(list, tuple)):
-        c1,c2 = move_param(c, p1, p2)
-        c = join_curve(c1,c2)
-        return c
+        return remap_params(c, [p2], [p1])
     else:
-        curves = move_params(c, p1, p2)
-        c = join_curves(curves)
-        return c
+        return remap_params(c, p2, p1)
 
 def param_samples(edge, samples=10):
     fp = edge.FirstParameter
@@ -761,30 +2218,62 @@ def param_samples(edge, samples=10):
     ra = lp-fp
     return [fp+float(i)*ra/(samples-1) for i in range(samples)]
 
-# doesn't work
-#def eval_smoothness(edge, samples=10):
-    #params = param_samples(edge, samples)
-    ## compute length score
-    #chord = edge.valueAt(edge.LastParameter) - edge.valueAt(edge.FirstParameter)
-    #if chord.Length > 1e-7: 
-        #length_score = (edge.Length / chord.Length) - 1.0
-    #else:
-        #length_score = None
-    ## compute tangent and curvature scores
-    #tans = list()
-    #curv = list()
-    #for p in params:
-        #tans.append(edge.tangentAt(p))
-        #curv.append(edge.curvatureAt(p))
-    #poly = Part.makePolygon(tans)
-    #tangent_score = poly.Length
-    #m = max(curv)
-    #if m > 1e-7:
-        #curvature_score = (m-min(curv))/m
-    #else:
-        #curvature_score = 0.0
-    #return length_score,tangent_score,curvature_score
-    
+def _smoothness_params(fp, lp, samples):
+    """Returns 2 * samples - 1 parameters in [fp, lp], graded towards both ends,
+    the derivatives of the parameters with respect to the uniform variable, and its step.
+    The parameter of the uniform variable u in [0, 1] is fp + (lp - fp) * (1 - cos(pi * u)) / 2,
+    so that the samples are dense where a blend curve turns sharply at small scales."""
+    u = np.linspace(0.0, 1.0, 2 * samples - 1)
+    params = fp + 0.5 * (lp - fp) * (1.0 - np.cos(np.pi * u))
+    jac = 0.5 * np.pi * (lp - fp) * np.sin(np.pi * u)
+    return params, jac, u[1] - u[0]
+
+def _simpson(values, h):
+    """Simpson rule on an odd number of uniform samples of step h"""
+    return h / 3.0 * (values[0] + values[-1] + 4.0 * values[1:-1:2].sum() + 2.0 * values[2:-1:2].sum())
+
+def _smoothness_scores(ders, jac, h):
+    """Smoothness scores of a curve from its derivatives 0 to 2 (array of shape (3, 2n-1, 3))
+    at the parameters returned by _smoothness_params, with the derivatives jac of the parameters,
+    and the step h of the uniform variable. The integrals use the Simpson rule.
+    Returns length_score, tangent_score, curvature_score (see eval_smoothness)"""
+    speed = np.maximum(np.linalg.norm(ders[1], axis=1), 1e-300)
+    cross = np.linalg.norm(np.cross(ders[1], ders[2]), axis=1)
+    length = _simpson(speed * jac, h)
+    chord = np.linalg.norm(ders[0,-1] - ders[0,0])
+    if chord > 1e-7:
+        length_score = float(length / chord - 1.0)
+    else:
+        length_score = None
+    tans = ders[1] / speed[:,None]
+    tangent_score = float(np.linalg.norm(np.diff(tans, axis=0), axis=1).sum())
+    # integrals of the curvature and of the squared curvature along the curve
+    turning = _simpson(cross / speed**2 * jac, h)
+    energy = _simpson(cross**2 / speed**5 * jac, h)
+    if turning > 1e-7:
+        curvature_score = float(length * energy / turning**2 - 1.0)
+    else:
+        curvature_score = 0.0
+    return length_score, tangent_score, curvature_score
+
+def eval_smoothness(edge, samples=10):
+    """Smoothness scores of an edge.
+    length_score, tangent_score, curvature_score = eval_smoothness(edge, samples=10)
+    - length_score : length / chord - 1 (None if the edge is closed)
+    - tangent_score : length of the polygon of the unit tangents at the samples
+    - curvature_score : length * integral(curvature**2) / integral(curvature)**2 - 1
+      It is 0 if the curvature is constant, and grows with the curvature variations,
+      for example at the sharp turns of a blend curve with too small scales.
+    The samples are graded towards the ends (see _smoothness_params).
+    Computed from the derivatives of the curve, evaluated in one call."""
+    fp, lp = edge.FirstParameter, edge.LastParameter
+    curve = edge.Curve
+    if not isinstance(curve, Part.BSplineCurve):
+        curve = curve.toBSpline(fp, lp)
+    params, jac, h = _smoothness_params(fp, lp, samples)
+    ders = BsplineCurveEvaluator(curve).derivatives(params, 2)
+    return _smoothness_scores(ders, jac, h)
+
 class EdgeInterpolator(object):
     """interpolate data along a path shape
     ei = EdgeInterpolator(edge or wire)"""
@@ -809,7 +2298,9 @@ class EdgeInterpolator(object):
             self.data.append((p,dat))
         else:
             if type(dat) == type(self.data[0][1]):
-                self.data.append((p,dat))
+                # keep the data sorted by parameter
+                i = bisect_right([d[0] for d in self.data], p)
+                self.data.insert(i, (p,dat))
             else:
                 FreeCAD.Console.PrintError("Bad type of data")
 
@@ -857,6 +2348,8 @@ class EdgeInterpolator(object):
 
     def build_params_and_points(self):
         self.sort()
+        self.parameters = list()
+        self.pts = list()
         for t in self.data:
             self.parameters.append(t[0])
             self.pts.append(self.get_point(t[1]))
@@ -877,6 +2370,197 @@ class EdgeInterpolator(object):
         else:
             return self.data[0][1]
 
+class EdgeArrayInterpolator(object):
+    """interpolate array data along a path shape
+    ei = EdgeArrayInterpolator(edge or wire, degree=3)
+    Each datum is an array of any shape (or a number, a list, a vector...).
+    All the channels share the same parameters, so they are interpolated
+    with a single factorization of the collocation matrix.
+    The data is kept sorted by parameter. Once interpolated, adding, moving or removing a datum
+    only recomputes the rows of the collocation matrix around it, and changing a value
+    reuses the factorization."""
+    def __init__(self, shape, degree=3):
+        self.degree = degree
+        self.parameters = np.zeros(0)
+        self.values = None
+        self.poles = None
+        self.basis = None
+        self.matrix = None
+        self._params = list()
+        self._values = list()
+        self._shape = None
+        if isinstance(shape, Part.Edge):
+            self.path = shape
+        elif isinstance(shape, Part.Wire):
+            path = shape.approximate(1e-8,1e-3,99,5) # &tol2d,&tol3d,&maxseg,&maxdeg
+            self.path = path.toShape()
+        else:
+            FreeCAD.Console.PrintError("EdgeArrayInterpolator input must be edge or wire")
+            raise ValueError
+
+    def __len__(self):
+        return len(self._params)
+
+    def _to_array(self, dat):
+        if isinstance(dat, FreeCAD.Base.Vector2d):
+            val = np.array([dat.x, dat.y])
+        else:
+            val = np.array(dat, dtype=float)
+        if self._shape is None:
+            self._shape = val.shape
+        elif not val.shape == self._shape:
+            FreeCAD.Console.PrintError("Bad shape of data : {} instead of {}".format(val.shape, self._shape))
+            return None
+        return val
+
+    def add_data(self, p, dat):
+        """add a datum on path, at given parameter
+        ei.add_data(parameter, datum)
+        Returns the index of the datum in the sorted data,
+        or None if the datum is rejected (bad shape, or parameter already used)"""
+        val = self._to_array(dat)
+        if val is None:
+            return None
+        i = bisect_right(self._params, float(p))
+        if self._used(float(p)) is not None:
+            FreeCAD.Console.PrintError("EdgeArrayInterpolator : parameter {} is already used".format(p))
+            return None
+        self._params.insert(i, float(p))
+        self._values.insert(i, val)
+        if self.poles is not None:
+            self._update(i, 1)
+        return i
+
+    def add_mult_data(self, dat):
+        """add multiple data values"""
+        if isinstance(dat,(list,tuple)):
+            for d in dat:
+                self.add_data(d[0],d[1])
+        else:
+            FreeCAD.Console.PrintError("Argument must be list or tuple")
+
+    def remove_data(self, i):
+        """remove the datum of index i (in the sorted data)"""
+        del self._params[i]
+        del self._values[i]
+        if self.poles is not None:
+            self._update(i, -1)
+
+    def move_data(self, i, p, dat=None):
+        """move the datum of index i to parameter p, and optionally change its value
+        Returns the new index of the datum, or None if the move is rejected
+        (bad shape, or parameter of another datum). A rejected move leaves the data unchanged."""
+        if dat is None:
+            dat = self._values[i]
+        if self._to_array(dat) is None:
+            return None
+        if float(p) == self._params[i]:
+            self.set_value(i, dat)
+            return i
+        if self._used(float(p)) is not None:
+            FreeCAD.Console.PrintError("EdgeArrayInterpolator : parameter {} is already used".format(p))
+            return None
+        self.remove_data(i)
+        return self.add_data(p, dat)
+
+    def _used(self, p):
+        """Returns the index of the datum at parameter p, or None"""
+        i = bisect_left(self._params, p)
+        if i < len(self._params) and self._params[i] == p:
+            return i
+        return None
+
+    def set_value(self, i, dat):
+        """change the value of the datum of index i
+        The factorization of the collocation matrix is reused"""
+        val = self._to_array(dat)
+        if val is None:
+            return
+        self._values[i] = val
+        if self.poles is not None:
+            self.values[i] = val.ravel()
+            self.poles = self.matrix.solve(self.values)
+
+    def _knots(self, params, degree):
+        # interior knots are averages of the parameters (Nurbs Book eq. 9.8)
+        avg = np.convolve(params, np.ones(degree) / degree, 'valid')[1:-1]
+        return np.concatenate(([params[0]] * (degree+1), avg, [params[-1]] * (degree+1)))
+
+    def _update(self, i, shift):
+        """Update the interpolation after the insertion (shift = 1) or the removal (shift = -1) of the datum of index i.
+        A datum only changes the knots averaged over its neighbours,
+        so only the rows of the collocation matrix close to i are computed again.
+        The other rows keep their values, with their span shifted after i."""
+        params = np.array(self._params)
+        n = len(params)
+        degree = min(self.degree, n - 1)
+        margin = 2 * degree + 2
+        if (n < 2) or (degree != self.basis.degree) or (n <= 2 * margin):
+            # small system : full update
+            self.poles = None
+            if n > 1:
+                self.interpolate()
+            return
+        self.basis.knots = self._knots(params, degree)
+        mat = self.matrix
+        if shift > 0:
+            first_cols = np.insert(mat.first_cols, i, 0)
+            values = np.insert(mat.values, i, 0.0, axis=0)
+            self.values = np.insert(self.values, i, self._values[i].ravel(), axis=0)
+            first_cols[i+1:] += 1
+        else:
+            first_cols = np.delete(mat.first_cols, i)
+            values = np.delete(mat.values, i, axis=0)
+            self.values = np.delete(self.values, i, axis=0)
+            first_cols[i:] -= 1
+        lo, hi = max(0, i - margin), min(n, i + margin + 1)
+        spans, ders = self.basis.evaluate_array(params[lo:hi])
+        first_cols[lo:hi] = spans - degree
+        values[lo:hi] = ders[:,0,:]
+        mat.size = n
+        mat.first_cols = first_cols
+        mat.values = values
+        mat.update()
+        mat.factorize()
+        self.parameters = params
+        self.poles = mat.solve(self.values)
+
+    def interpolate(self):
+        """Compute the interpolating BSpline of all the channels"""
+        if len(self._params) < 2:
+            return
+        params = np.array(self._params)
+        if np.any(np.diff(params) <= 0):
+            FreeCAD.Console.PrintError("EdgeArrayInterpolator : several data at the same parameter")
+            raise ValueError
+        values = np.array(self._values).reshape(len(params), -1)
+        degree = min(self.degree, len(params) - 1)
+        self.basis = BsplineBasis()
+        self.basis.knots = self._knots(params, degree)
+        self.basis.degree = degree
+        self.matrix = CollocationMatrix(self.basis, params, np.zeros(len(params), dtype=int))
+        self.matrix.factorize()
+        self.parameters = params
+        self.values = values
+        self.poles = self.matrix.solve(values)
+
+    def valueAt(self, p):
+        """Interpolated data at parameter p (float or array of floats)
+        Returns an array of the data shape, or of shape (len(p),) + data shape"""
+        scalar = np.ndim(p) == 0
+        u = np.atleast_1d(np.asarray(p, dtype=float))
+        if len(self._params) == 1:
+            res = np.broadcast_to(self._values[0], (len(u),) + self._shape).copy()
+        else:
+            if self.poles is None:
+                self.interpolate()
+            spans, ders = self.basis.evaluate_array(u)
+            idx = spans[:,None] - self.basis.degree + np.arange(self.basis.degree+1)
+            res = np.einsum('mj,mjc->mc', ders[:,0,:], self.poles[idx]).reshape((len(u),) + self._shape)
+        if scalar:
+            return res[0]
+        return res
+
 def projection_quad(pts, param_range=[0,1,0,1], extend_factor=1.0):
     """
     quad = projection_quad(pts, param_range=[0,1,0,1])
@@ -937,3 +2621,42 @@ def test(parm):
     print(basis1.evaluate(parm,d=1).A1.tolist())
     print(basis1.evaluate(parm,d=2).A1.tolist())
 
+
+def test_hausdorff(max_evals=2000):
+    """Regression check of hausdorff_distance on identical and offset curves.
+    The distance hardly varies along such curves : the search has to stop, converged
+    or on its max_evals budget, with a bound that contains the exact distance."""
+    poles = [FreeCAD.Vector(0,0,0), FreeCAD.Vector(1,2,0), FreeCAD.Vector(3,-1,1), FreeCAD.Vector(4,1,0),
+             FreeCAD.Vector(6,2,-1), FreeCAD.Vector(7,0,0), FreeCAD.Vector(8,1,2), FreeCAD.Vector(10,0,0)]
+    result = True
+    for offset in (0.0, 1e-5, 1e-3):
+        c1 = Part.BSplineCurve()
+        c1.buildFromPolesMultsKnots(poles, [4,1,1,1,1,4], [0.0,0.2,0.4,0.6,0.8,1.0], False, 3)
+        c2 = Part.BSplineCurve()
+        c2.buildFromPolesMultsKnots([p + FreeCAD.Vector(0,0,offset) for p in poles], [4,1,1,1,1,4], [0.0,0.2,0.4,0.6,0.8,1.0], False, 3)
+        dist, pts, bound = hausdorff_distance(c1, c2, max_evals=max_evals)
+        ok = (abs(dist - offset) < 1e-9) and (dist <= bound) and (bound - offset < 1e-4)
+        print("offset {} : distance {}, bound {} -> {}".format(offset, dist, bound, "OK" if ok else "FAILED"))
+        result = result and ok
+    return result
+
+def test_blend_autoscale(maxscale=3.0):
+    """Regression check of blendCurve.autoscale on a fillet between two perpendicular lines.
+    Too small scales give sharp turns at the ends, too large ones give wiggles :
+    the best scales have to be strictly between the bounds of the search."""
+    minscale = .01
+    e1 = Part.LineSegment(FreeCAD.Vector(-1,0,0), FreeCAD.Vector(0,0,0)).toShape()
+    e2 = Part.LineSegment(FreeCAD.Vector(1,1,0), FreeCAD.Vector(1,2,0)).toShape()
+    result = True
+    for cont in (1, 2):
+        bc = blendCurve(e1, e2)
+        bc.param1 = bc.edge1.LastParameter
+        bc.param2 = bc.edge2.FirstParameter
+        bc.cont1 = bc.cont2 = cont
+        bc.scale1 = 1.0
+        bc.scale2 = -1.0
+        s1, s2 = bc.autoscale(maxscale=maxscale)
+        ok = (minscale < s1 < maxscale) and (minscale < -s2 < maxscale)
+        print("G{} fillet : scales ({}, {}) -> {}".format(cont, s1, s2, "OK" if ok else "FAILED"))
+        result = result and ok
+    return result